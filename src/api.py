@@ -0,0 +1,168 @@
+"""
+Asynchronous HTTP API
+
+Serves the same fetch/score/render pipeline as the daily action and the
+Gradio app to internal consumers. Handlers are async; the blocking pipeline
+steps run in worker threads, with one semaphore bounding concurrent LLM scoring
+for /score and /digest renders.
+One process shares the in-process listing cache, the score cache, the HTTP
+connection pool to the LLM endpoint and the rendered digests of the day, and
+concurrent requests for the same digest wait on a single render.
+
+Usage (fastapi and uvicorn are in requirements.txt):
+    uvicorn api:app --app-dir src --port 8000
+    curl "localhost:8000/papers?field=cs&categories=Machine%20Learning&limit=5"
+    curl -X POST localhost:8000/score -H 'Content-Type: application/json' \
+        -d '{"field": "cs", "limit": 4, "interest": "analog circuit sizing"}'
+    curl "localhost:8000/digest?format=text"
+
+Environment:
+    ARXIV_DIGEST_CONFIG        config file for /score and /digest (default config.yaml)
+    ARXIV_DIGEST_SCORE_CACHE   score cache path (default ./data/score_cache.jsonl)
+    ARXIV_DIGEST_API_SCORING   concurrent scoring calls (default 4)
+"""
+import asyncio
+import contextlib
+import os
+from typing import List, Optional
+
+import yaml
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from pydantic import BaseModel
+
+from action import build_custom_api_config, generate_body_enhanced, topic_abbr
+from categories import topics, physics_topics
+from download_new_papers import get_papers, _today
+from relevancy import generate_relevance_score
+from render import render_page
+from score_cache import ScoreCache
+
+CONFIG_PATH = os.environ.get("ARXIV_DIGEST_CONFIG", "config.yaml")
+SCORE_CACHE_PATH = os.environ.get("ARXIV_DIGEST_SCORE_CACHE", "./data/score_cache.jsonl")
+SCORING_SLOTS = int(os.environ.get("ARXIV_DIGEST_API_SCORING", "4"))
+
+# 当天已渲染的 digest: {(日期, 配置文件 mtime, max_kb): 进行中或已完成的 Task}
+_digests = {}
+
+# 返回给调用方时去掉的内部字段
+_INTERNAL_KEYS = ("subject_mask",)
+# 调用方直接提交论文时必须包含的字段
+_REQUIRED_KEYS = {"main_page", "title", "authors", "abstract"}
+
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # 评分缓存在启动时而不是导入时加载；信号量在服务的事件循环中创建
+    app.state.score_cache = ScoreCache(SCORE_CACHE_PATH)
+    app.state.scoring = asyncio.Semaphore(SCORING_SLOTS)
+    yield
+    _digests.clear()
+
+
+app = FastAPI(title="ArxivDigest API", lifespan=lifespan)
+
+
+class ScoreRequest(BaseModel):
+    interest: str
+    papers: Optional[List[dict]] = None
+    field: Optional[str] = None
+    categories: List[str] = []
+    limit: Optional[int] = None
+    threshold: int = 0
+    num_paper_in_prompt: int = 8
+
+
+def _load_config():
+    with open(CONFIG_PATH, "r") as f:
+        return yaml.safe_load(f)
+
+
+def _field_abbr(field):
+    """Accept a listing abbreviation (cs) or a topic name (Computer Science)."""
+    if field in topics.values() or field in physics_topics.values():
+        return field
+    try:
+        return topic_abbr(field)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _public(paper):
+    return {k: v for k, v in paper.items() if k not in _INTERNAL_KEYS}
+
+
+@app.get("/papers")
+async def list_papers(field: str, categories: List[str] = Query(default=[]), limit: Optional[int] = None):
+    papers = await asyncio.to_thread(get_papers, _field_abbr(field), limit, None, categories)
+    return {"date": _today().isoformat(), "count": len(papers), "papers": [_public(p) for p in papers]}
+
+
+@app.post("/score")
+async def score(request: ScoreRequest):
+    if request.papers is not None:
+        papers = request.papers
+    elif request.field:
+        papers = await asyncio.to_thread(get_papers, _field_abbr(request.field), request.limit, None,
+                                         request.categories)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either papers or field")
+    missing = [i for i, paper in enumerate(papers) if not _REQUIRED_KEYS <= paper.keys()]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Papers {missing} need {', '.join(sorted(_REQUIRED_KEYS))}")
+    if not papers:
+        return {"hallucination": False, "papers": []}
+
+    custom_api_config, model_name = build_custom_api_config(_load_config())
+    async with app.state.scoring:
+        relevancy, hallucination = await asyncio.to_thread(
+            generate_relevance_score,
+            papers,
+            query={"interest": request.interest},
+            model_name=model_name,
+            threshold_score=request.threshold,
+            num_paper_in_prompt=request.num_paper_in_prompt,
+            custom_api_config=custom_api_config,
+            score_cache=app.state.score_cache,
+        )
+    return {"hallucination": hallucination, "papers": [_public(p) for p in relevancy]}
+
+
+def _render_digest(max_kb, score_cache):
+    config = _load_config()
+    if max_kb:
+        config["max_digest_kb"] = max_kb
+    body = generate_body_enhanced(config, score_cache=score_cache)
+    return render_page(body, _today().strftime("%d %b %Y"), compact=bool(config.get("max_digest_kb")))
+
+
+async def _render_digest_limited(max_kb):
+    # digest 的渲染同样要评分，与 /score 共用并发上限
+    async with app.state.scoring:
+        return await asyncio.to_thread(_render_digest, max_kb, app.state.score_cache)
+
+
+@app.get("/digest")
+async def digest(format: str = "html", max_kb: Optional[int] = None):
+    if format not in ("html", "text"):
+        raise HTTPException(status_code=400, detail="format must be html or text")
+    key = (_today(), os.path.getmtime(CONFIG_PATH), max_kb)
+    task = _digests.get(key)
+    if task is None or (task.done() and task.exception() is not None):
+        # 同一 digest 的并发请求共用一次渲染
+        for stale in [k for k in _digests if k[0] != key[0]]:
+            del _digests[stale]
+        task = _digests[key] = asyncio.ensure_future(_render_digest_limited(max_kb))
+    page_html, page_text = await asyncio.shield(task)
+    if format == "text":
+        return PlainTextResponse(page_text)
+    return HTMLResponse(page_html)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
@@ -1,64 +1,60 @@
 import gradio as gr
 from download_new_papers import get_papers
 import utils
-from relevancy import generate_relevance_score, process_subject_fields
-from sendgrid.helpers.mail import Mail, Email, To, Content
-import sendgrid
+from relevancy import generate_relevance_score, item_score, stream_relevance_score, summarized_text
+from categories import topics, physics_topics, category_map as categories_map
+from mailer import deliver_sendgrid
+from render import HALLUCINATION_WARNING, render_scored, render_listing, render_page
+from score_cache import ScoreCache
+from prefetch import Prefetcher
 import os
-import openai
-
-topics = {
-    "Physics": "",
-    "Mathematics": "math",
-    "Computer Science": "cs",
-    "Quantitative Biology": "q-bio",
-    "Quantitative Finance": "q-fin",
-    "Statistics": "stat",
-    "Electrical Engineering and Systems Science": "eess",
-    "Economics": "econ"
-}
-
-physics_topics = {
-    "Astrophysics": "astro-ph",
-    "Condensed Matter": "cond-mat",
-    "General Relativity and Quantum Cosmology": "gr-qc",
-    "High Energy Physics - Experiment": "hep-ex",
-    "High Energy Physics - Lattice": "hep-lat",
-    "High Energy Physics - Phenomenology": "hep-ph",
-    "High Energy Physics - Theory": "hep-th",
-    "Mathematical Physics": "math-ph",
-    "Nonlinear Sciences": "nlin",
-    "Nuclear Experiment": "nucl-ex",
-    "Nuclear Theory": "nucl-th",
-    "Physics": "physics",
-    "Quantum Physics": "quant-ph"
-}
-
-categories_map = {
-    "Astrophysics": ["Astrophysics of Galaxies", "Cosmology and Nongalactic Astrophysics", "Earth and Planetary Astrophysics", "High Energy Astrophysical Phenomena", "Instrumentation and Methods for Astrophysics", "Solar and Stellar Astrophysics"],
-    "Condensed Matter": ["Disordered Systems and Neural Networks", "Materials Science", "Mesoscale and Nanoscale Physics", "Other Condensed Matter", "Quantum Gases", "Soft Condensed Matter", "Statistical Mechanics", "Strongly Correlated Electrons", "Superconductivity"],
-    "General Relativity and Quantum Cosmology": ["None"],
-    "High Energy Physics - Experiment": ["None"],
-    "High Energy Physics - Lattice": ["None"],
-    "High Energy Physics - Phenomenology": ["None"],
-    "High Energy Physics - Theory": ["None"],
-    "Mathematical Physics": ["None"],
-    "Nonlinear Sciences": ["Adaptation and Self-Organizing Systems", "Cellular Automata and Lattice Gases", "Chaotic Dynamics", "Exactly Solvable and Integrable Systems", "Pattern Formation and Solitons"],
-    "Nuclear Experiment": ["None"],
-    "Nuclear Theory": ["None"],
-    "Physics": ["Accelerator Physics", "Applied Physics", "Atmospheric and Oceanic Physics", "Atomic and Molecular Clusters", "Atomic Physics", "Biological Physics", "Chemical Physics", "Classical Physics", "Computational Physics", "Data Analysis, Statistics and Probability", "Fluid Dynamics", "General Physics", "Geophysics", "History and Philosophy of Physics", "Instrumentation and Detectors", "Medical Physics", "Optics", "Physics and Society", "Physics Education", "Plasma Physics", "Popular Physics", "Space Physics"],
-    "Quantum Physics": ["None"],
-    "Mathematics": ["Algebraic Geometry", "Algebraic Topology", "Analysis of PDEs", "Category Theory", "Classical Analysis and ODEs", "Combinatorics", "Commutative Algebra", "Complex Variables", "Differential Geometry", "Dynamical Systems", "Functional Analysis", "General Mathematics", "General Topology", "Geometric Topology", "Group Theory", "History and Overview", "Information Theory", "K-Theory and Homology", "Logic", "Mathematical Physics", "Metric Geometry", "Number Theory", "Numerical Analysis", "Operator Algebras", "Optimization and Control", "Probability", "Quantum Algebra", "Representation Theory", "Rings and Algebras", "Spectral Theory", "Statistics Theory", "Symplectic Geometry"],
-    "Computer Science": ["Artificial Intelligence", "Computation and Language", "Computational Complexity", "Computational Engineering, Finance, and Science", "Computational Geometry", "Computer Science and Game Theory", "Computer Vision and Pattern Recognition", "Computers and Society", "Cryptography and Security", "Data Structures and Algorithms", "Databases", "Digital Libraries", "Discrete Mathematics", "Distributed, Parallel, and Cluster Computing", "Emerging Technologies", "Formal Languages and Automata Theory", "General Literature", "Graphics", "Hardware Architecture", "Human-Computer Interaction", "Information Retrieval", "Information Theory", "Logic in Computer Science", "Machine Learning", "Mathematical Software", "Multiagent Systems", "Multimedia", "Networking and Internet Architecture", "Neural and Evolutionary Computing", "Numerical Analysis", "Operating Systems", "Other Computer Science", "Performance", "Programming Languages", "Robotics", "Social and Information Networks", "Software Engineering", "Sound", "Symbolic Computation", "Systems and Control"],
-    "Quantitative Biology": ["Biomolecules", "Cell Behavior", "Genomics", "Molecular Networks", "Neurons and Cognition", "Other Quantitative Biology", "Populations and Evolution", "Quantitative Methods", "Subcellular Processes", "Tissues and Organs"],
-    "Quantitative Finance": ["Computational Finance", "Economics", "General Finance", "Mathematical Finance", "Portfolio Management", "Pricing of Securities", "Risk Management", "Statistical Finance", "Trading and Market Microstructure"],
-    "Statistics": ["Applications", "Computation", "Machine Learning", "Methodology", "Other Statistics", "Statistics Theory"],
-    "Electrical Engineering and Systems Science": ["Audio and Speech Processing", "Image and Video Processing", "Signal Processing", "Systems and Control"],
-    "Economics": ["Econometrics", "General Economics", "Theoretical Economics"]
-}
-
-
-def sample(email, topic, physics_topic, categories, interest):
+import time
+
+
+# 请求之间共享的评分缓存；后台线程每天预取所有列表，并可选地为近期的兴趣描述预先评分
+SCORE_CACHE = ScoreCache(os.environ.get("ARXIV_DIGEST_SCORE_CACHE", "./data/score_cache.jsonl"))
+PREFETCHER = Prefetcher(
+    prescore=os.environ.get("ARXIV_DIGEST_PRESCORE", "false").lower() == "true",
+    score_cache=SCORE_CACHE,
+)
+
+# 连续修改下拉框时，只有停顿超过该时间后的最后一次修改才会真正开始评分
+DEBOUNCE_SECONDS = 0.8
+
+
+def _start_run(session):
+    """
+    每个会话的任务句柄：新的运行递增 generation，旧的运行在下一个检查点发现自己已过时后退出
+    """
+    session["generation"] = session.get("generation", 0) + 1
+    return session["generation"]
+
+
+def _is_stale(session, generation):
+    return session.get("generation") != generation
+
+
+def _require_openai_key():
+    """
+    评分前检查 OpenAI 库和 API key；openai 未安装时 load_openai 返回 None
+    """
+    try:
+        key = utils.load_openai()[0].api_key
+    except (AttributeError, ImportError):
+        raise gr.Error("Install openai and set your API key")
+    if not key:
+        raise gr.Error("Set your OpenAI api key on the left first")
+
+
+def sample(email, topic, physics_topic, categories, interest, session, debounce=0):
+    """
+    Stream the sample digest, one scored paper at a time
+    """
+    generation = _start_run(session)
+    if debounce:
+        time.sleep(debounce)
+        if _is_stale(session, generation):
+            return
     if not topic:
         raise gr.Error("You must choose a topic.")
     if topic == "Physics":
@@ -68,23 +64,33 @@ def sample(email, topic, physics_topic, categories, interest):
         abbr = physics_topics[topic]
     else:
         abbr = topics[topic]
-    if categories:
-        papers = get_papers(abbr)
-        papers = [
-            t for t in papers
-            if bool(set(process_subject_fields(t['subjects'])) & set(categories))][:4]
-    else:
-        papers = get_papers(abbr, limit=4)
-    if interest:
-        if not openai.api_key: raise gr.Error("Set your OpenAI api key on the left first")
-        relevancy, _ = generate_relevance_score(
-            papers,
-            query={"interest": interest},
-            threshold_score=0,
-            num_paper_in_prompt=4)
-        return "\n\n".join([paper["summarized_text"] for paper in relevancy])
-    else:
-        return "\n\n".join(f"Title: {paper['title']}\nAuthors: {paper['authors']}" for paper in papers)
+    papers = get_papers(abbr, limit=4, categories=categories)
+    if not interest:
+        yield "\n\n".join(f"Title: {paper['title']}\nAuthors: {paper['authors']}" for paper in papers)
+        return
+    _require_openai_key()
+    PREFETCHER.note_interest(abbr, categories, interest)
+
+    yield f"Scoring {len(papers)} papers..."
+    # 所有论文仍放在一个请求里 (共享提示词只计费一次)，流式解析，每篇论文的回答写完就刷新一次结果
+    scored = stream_relevance_score(papers, query={"interest": interest}, score_cache=SCORE_CACHE)
+    relevancy = []
+    try:
+        for paper in scored:
+            if _is_stale(session, generation):
+                return
+            relevancy.append(paper)
+            relevancy.sort(key=item_score, reverse=True)
+            yield "\n\n".join(summarized_text(paper) for paper in relevancy)
+    finally:
+        # 被取消或已过时：关闭流，中止仍在生成的请求
+        scored.close()
+    if len(relevancy) < len(papers):
+        yield "\n\n".join([HALLUCINATION_WARNING] + [summarized_text(paper) for paper in relevancy])
+
+
+def sample_debounced(email, topic, physics_topic, categories, interest, session):
+    yield from sample(email, topic, physics_topic, categories, interest, session, debounce=DEBOUNCE_SECONDS)
 
 
 def change_subsubject(subject, physics_subject):
@@ -114,48 +120,36 @@ def test(email, topic, physics_topic, categories, interest, key):
         abbr = physics_topics[topic]
     else:
         abbr = topics[topic]
-    if categories:
-        papers = get_papers(abbr)
-        papers = [
-            t for t in papers
-            if bool(set(process_subject_fields(t['subjects'])) & set(categories))][:4]
-    else:
-        papers = get_papers(abbr, limit=4)
+    papers = get_papers(abbr, limit=4, categories=categories)
     if interest:
-        if not openai.api_key: raise gr.Error("Set your OpenAI api key on the left first")
+        _require_openai_key()
         relevancy, hallucination = generate_relevance_score(
             papers,
             query={"interest": interest},
             threshold_score=7,
             num_paper_in_prompt=8)
-        body = "<br><br>".join([f'Title: <a href="{paper["main_page"]}">{paper["title"]}</a><br>Authors: {paper["authors"]}<br>Score: {paper["Relevancy score"]}<br>Reason: {paper["Reasons for match"]}' for paper in relevancy])
-        if hallucination:
-            body = "Warning: the model hallucinated some papers. We have tried to remove them, but the scores may not be accurate.<br><br>" + body
+        body = render_scored(relevancy, hallucination)
     else:
-        body = "<br><br>".join([f'Title: <a href="{paper["main_page"]}">{paper["title"]}</a><br>Authors: {paper["authors"]}' for paper in papers])
-    sg = sendgrid.SendGridAPIClient(api_key=key)
-    from_email = Email(email)
-    to_email = To(email)
-    subject = "arXiv digest"
-    content = Content("text/html", body)
-    mail = Mail(from_email, to_email, subject, content)
-    mail_json = mail.get()
-
-    # Send an HTTP POST request to /mail/send
-    response = sg.client.mail.send.post(request_body=mail_json)
-    if response.status_code >= 200 and response.status_code <= 300:
+        body = render_listing(papers)
+    html_content, text_content = render_page(body, "arXiv digest")
+    sent, failed = deliver_sendgrid(key, "arXiv digest", html_content, email, [email], text_content=text_content)
+    if sent:
         return "Success!"
     else:
-        return "Failure: ({response.status_code})"
+        return f"Failure: ({failed[email]})"
 
 
 def register_openai_token(token):
+    openai, _ = utils.load_openai()
+    if openai is None:
+        raise gr.Error("Install openai and set your API key")
     openai.api_key = token
 
 with gr.Blocks() as demo:
     with gr.Row():
         with gr.Column(scale=1):
             token = gr.Textbox(label="OpenAI API Key", type="password")
+            session = gr.State({})
             subject = gr.Radio(
                 list(topics.keys()), label="Topic"
             )
@@ -186,10 +180,20 @@ with gr.Blocks() as demo:
                     output = gr.Textbox(show_label=False, placeholder="email status")
     test_btn.click(fn=test, inputs=[email, subject, physics_subject, subsubject, interest, sendgrid_token], outputs=output)
     token.change(fn=register_openai_token, inputs=[token])
-    sample_btn.click(fn=sample, inputs=[email, subject, physics_subject, subsubject, interest], outputs=sample_output)
-    subject.change(fn=sample, inputs=[email, subject, physics_subject, subsubject, interest], outputs=sample_output)
-    physics_subject.change(fn=sample, inputs=[email, subject, physics_subject, subsubject, interest], outputs=sample_output)
-    subsubject.change(fn=sample, inputs=[email, subject, physics_subject, subsubject, interest], outputs=sample_output)
-    interest.submit(fn=sample, inputs=[email, subject, physics_subject, subsubject, interest], outputs=sample_output)
-
-demo.launch(show_api=False)
+    # Dropdown changes are debounced; an explicit request cancels runs they started.
+    # Any newer run also makes older ones of the session stop at their next checkpoint.
+    sample_inputs = [email, subject, physics_subject, subsubject, interest, session]
+    change_events = [
+        component.change(fn=sample_debounced, inputs=sample_inputs, outputs=sample_output)
+        for component in (subject, physics_subject, subsubject)
+    ]
+    sample_btn.click(fn=sample, inputs=sample_inputs, outputs=sample_output, cancels=change_events)
+    interest.submit(fn=sample, inputs=sample_inputs, outputs=sample_output, cancels=change_events)
+
+# Gradio 3 的写法；Gradio 4 起改为 default_concurrency_limit
+demo.queue(concurrency_count=8)
+
+if __name__ == "__main__":
+    if os.environ.get("ARXIV_DIGEST_PREFETCH", "true").lower() != "false":
+        PREFETCHER.start()
+    demo.launch(show_api=False)
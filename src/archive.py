@@ -0,0 +1,276 @@
+"""
+Compact columnar archive for long-term paper history
+
+Rolls the per-day listing files under ./data into one NumPy-backed store:
+
+    archive/
+        meta.json                 field and subject dictionaries, other ids
+        day.npy                   int32, days since 1970-01-01
+        field.npy                 uint8, index into meta["fields"]
+        id.npy                    uint32, arXiv id packed as yymm * 100000 + number
+        subject.npy               int32, index into meta["subjects"]
+        {title,authors,abstract}.bin / _offsets.npy
+                                  utf-8 text blob plus int64 row offsets
+
+`main_page` and `pdf` are derived from the id, subjects are dictionary encoded,
+and every column is opened memory-mapped, so scanning a year of papers by
+date, field or category only touches the columns it needs.
+
+Usage:
+    python src/archive.py compact --data-dir ./data --archive-dir ./archive
+    python src/archive.py scan --archive-dir ./archive --categories "Machine Learning" --start 2024-01-01
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+from categories import build_mask_matrix, subject_filter_mask
+
+TEXT_COLUMNS = ("title", "authors", "abstract")
+_EPOCH = datetime.date(1970, 1, 1)
+_NEW_STYLE_ID = re.compile(r'^(\d{4})\.(\d{4,5})$')
+# id.npy 中最高位置1表示非标准编号，低位为 meta["other_ids"] 的下标
+_OTHER_ID_FLAG = 0x80000000
+_DAILY_FILE = re.compile(r'^(?P<field>[\w.-]+)_(?P<date>\w{3}, \d{2} \w{3} \d{2})\.jsonl$')
+
+
+def _pack_id(paper_number, other_ids):
+    match = _NEW_STYLE_ID.match(paper_number)
+    if match:
+        return int(match.group(1)) * 100000 + int(match.group(2))
+    other_ids.append(paper_number)
+    return _OTHER_ID_FLAG | (len(other_ids) - 1)
+
+
+def _unpack_id(packed, other_ids):
+    packed = int(packed)
+    if packed & _OTHER_ID_FLAG:
+        return other_ids[packed & ~_OTHER_ID_FLAG]
+    yymm, number = divmod(packed, 100000)
+    # 2015年1月起编号为5位，之前为4位
+    width = 5 if yymm >= 1501 else 4
+    return f"{yymm:04d}.{number:0{width}d}"
+
+
+def _daily_files(data_dir):
+    """
+    找出 data_dir 中的每日列表文件，返回 [(date, field_abbr, path)]
+    """
+    found = []
+    for path in glob.glob(os.path.join(data_dir, "*.jsonl")):
+        match = _DAILY_FILE.match(os.path.basename(path))
+        if not match:
+            continue  # 如 score_cache.jsonl
+        day = datetime.datetime.strptime(match.group("date"), "%a, %d %b %y").date()
+        found.append((day, match.group("field"), path))
+    return sorted(found)
+
+
+class PaperArchive:
+    """
+    只读、内存映射的论文归档
+    """
+
+    def __init__(self, archive_dir="./archive"):
+        self.archive_dir = archive_dir
+        with open(os.path.join(archive_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.fields = self.meta["fields"]
+        self.subjects = self.meta["subjects"]
+        self.other_ids = self.meta["other_ids"]
+
+        def load(name):
+            return np.load(os.path.join(archive_dir, name + ".npy"), mmap_mode="r")
+
+        self.day = load("day")
+        self.field = load("field")
+        self.id = load("id")
+        self.subject = load("subject")
+        self._offsets = {col: load(col + "_offsets") for col in TEXT_COLUMNS}
+        self._blobs = {}
+        for col in TEXT_COLUMNS:
+            path = os.path.join(archive_dir, col + ".bin")
+            # 空文件无法 memmap
+            self._blobs[col] = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else b""
+
+        # 类别 mask 按字典项计算 (不随行数增长)，也不受 SUBJECT_VOCABULARY 变化影响
+        self._subject_masks = build_mask_matrix([{"subjects": s} for s in self.subjects])
+
+    def __len__(self):
+        return len(self.day)
+
+    def text(self, column, i):
+        offsets = self._offsets[column]
+        return bytes(self._blobs[column][offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def paper_id(self, i):
+        return _unpack_id(self.id[i], self.other_ids)
+
+    def paper(self, i):
+        """
+        还原第 i 行为与每日 jsonl 相同格式的论文字典
+        """
+        paper_number = self.paper_id(i)
+        return {
+            'main_page': "https://arxiv.org/abs/" + paper_number,
+            'pdf': "https://arxiv.org/pdf/" + paper_number,
+            'title': self.text("title", i),
+            'authors': self.text("authors", i),
+            'subjects': self.subjects[self.subject[i]],
+            'abstract': self.text("abstract", i),
+        }
+
+    def date(self, i):
+        return _EPOCH + datetime.timedelta(days=int(self.day[i]))
+
+    def select(self, start=None, end=None, fields=None, categories=None):
+        """
+        向量化筛选，返回满足全部条件的行号数组
+
+        start/end: datetime.date，闭区间
+        fields: 领域缩写列表，如 ["cs", "eess"]
+        categories: 类别名称列表，与 filter_papers_by_subjects 语义相同
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if start is not None:
+            keep &= self.day >= (start - _EPOCH).days
+        if end is not None:
+            keep &= self.day <= (end - _EPOCH).days
+        if fields:
+            codes = [self.fields.index(f) for f in fields if f in self.fields]
+            keep &= np.isin(self.field, codes)
+        if categories:
+            keep &= subject_filter_mask(self._subject_masks, categories)[self.subject]
+        return np.flatnonzero(keep)
+
+    def iter_rows(self):
+        """
+        逐行产生 (date, field_abbr, paper)
+        """
+        for i in range(len(self)):
+            yield self.date(i), self.fields[self.field[i]], self.paper(i)
+
+
+def _write_archive(rows, archive_dir):
+    """
+    rows: [(date, field_abbr, paper_dict)]，已去重并排序
+    """
+    fields, subjects, other_ids = [], [], []
+    field_codes, subject_codes = {}, {}
+    n = len(rows)
+    day = np.empty(n, dtype=np.int32)
+    field = np.empty(n, dtype=np.uint8)
+    ids = np.empty(n, dtype=np.uint32)
+    subject = np.empty(n, dtype=np.int32)
+    blobs = {col: bytearray() for col in TEXT_COLUMNS}
+    offsets = {col: np.zeros(n + 1, dtype=np.int64) for col in TEXT_COLUMNS}
+
+    for i, (date, abbr, paper) in enumerate(rows):
+        day[i] = (date - _EPOCH).days
+        if abbr not in field_codes:
+            field_codes[abbr] = len(fields)
+            fields.append(abbr)
+        field[i] = field_codes[abbr]
+        ids[i] = _pack_id(paper['main_page'].rsplit('/', 1)[-1], other_ids)
+        subjects_text = paper.get('subjects', "")
+        if subjects_text not in subject_codes:
+            subject_codes[subjects_text] = len(subjects)
+            subjects.append(subjects_text)
+        subject[i] = subject_codes[subjects_text]
+        for col in TEXT_COLUMNS:
+            blobs[col] += paper.get(col, "").encode("utf-8")
+            offsets[col][i + 1] = len(blobs[col])
+
+    os.makedirs(archive_dir)
+    np.save(os.path.join(archive_dir, "day.npy"), day)
+    np.save(os.path.join(archive_dir, "field.npy"), field)
+    np.save(os.path.join(archive_dir, "id.npy"), ids)
+    np.save(os.path.join(archive_dir, "subject.npy"), subject)
+    for col in TEXT_COLUMNS:
+        with open(os.path.join(archive_dir, col + ".bin"), "wb") as f:
+            f.write(blobs[col])
+        np.save(os.path.join(archive_dir, col + "_offsets.npy"), offsets[col])
+    with open(os.path.join(archive_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "count": n, "fields": fields, "subjects": subjects,
+                   "other_ids": other_ids}, f, ensure_ascii=False)
+
+
+def compact(data_dir="./data", archive_dir="./archive", remove_daily=False):
+    """
+    将每日 jsonl 文件并入归档。已有归档会被读回并与新文件合并后整体重写
+    (先写临时目录再替换)，同一天同一领域的同一论文只保留一份。
+    remove_daily 删除已并入的每日文件，之后 download_new_papers.get_listing 从归档读取这些日期
+    (归档需位于 ARXIV_DIGEST_ARCHIVE_DIR，默认 ./archive)
+
+    Returns:
+        int: 归档中的论文总数
+    """
+    rows = {}
+    if os.path.exists(os.path.join(archive_dir, "meta.json")):
+        existing = PaperArchive(archive_dir)
+        for date, abbr, paper in existing.iter_rows():
+            rows[(date, abbr, paper['main_page'])] = (date, abbr, paper)
+        print(f"📦 已有归档: {len(existing)} 篇论文")
+
+    daily_files = _daily_files(data_dir)
+    for date, abbr, path in daily_files:
+        with open(path, "r") as f:
+            for line in f:
+                paper = json.loads(line)
+                rows[(date, abbr, paper['main_page'])] = (date, abbr, paper)
+    print(f"📥 读取 {len(daily_files)} 个每日文件")
+
+    ordered = [rows[key] for key in sorted(rows, key=lambda k: (k[0], k[1], k[2]))]
+    tmp_dir = archive_dir.rstrip("/") + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    _write_archive(ordered, tmp_dir)
+    if os.path.exists(archive_dir):
+        shutil.rmtree(archive_dir)
+    os.replace(tmp_dir, archive_dir)
+
+    if remove_daily:
+        for _, _, path in daily_files:
+            os.remove(path)
+        print(f"🗑️ 已删除 {len(daily_files)} 个每日文件")
+
+    daily_bytes = sum(os.path.getsize(path) for _, _, path in daily_files) if not remove_daily else 0
+    archive_bytes = sum(os.path.getsize(p) for p in glob.glob(os.path.join(archive_dir, "*")))
+    print(f"✅ 归档完成: {len(ordered)} 篇论文, {archive_bytes / 1024:.1f} KB"
+          + (f" (每日文件 {daily_bytes / 1024:.1f} KB)" if daily_bytes else ""))
+    return len(ordered)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Roll daily jsonl files into the archive")
+    compact_parser.add_argument("--data-dir", default="./data")
+    compact_parser.add_argument("--archive-dir", default="./archive")
+    compact_parser.add_argument("--remove-daily", action="store_true", help="Delete daily files after compaction; dated listings are then read from the archive")
+
+    scan_parser = subparsers.add_parser("scan", help="Count archived papers matching a filter")
+    scan_parser.add_argument("--archive-dir", default="./archive")
+    scan_parser.add_argument("--start", type=datetime.date.fromisoformat)
+    scan_parser.add_argument("--end", type=datetime.date.fromisoformat)
+    scan_parser.add_argument("--fields", nargs="*")
+    scan_parser.add_argument("--categories", nargs="*")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact(args.data_dir, args.archive_dir, remove_daily=args.remove_daily)
+    else:
+        start_time = time.perf_counter()
+        archive = PaperArchive(args.archive_dir)
+        rows = archive.select(args.start, args.end, args.fields, args.categories)
+        print(f"🔍 {len(rows)}/{len(archive)} 篇论文匹配, 用时 {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        for i in rows[:5]:
+            print(f"  {archive.date(i)} {archive.paper_id(i)} {archive.text('title', i)[:80]}")
@@ -0,0 +1,305 @@
+"""
+Historical backfill over a date range
+
+Ingests past arXiv submissions through the OAI-PMH interface (or a local fixture
+directory with the same XML), stores them as the usual per-day listing files
+under ./data, then scores the days in parallel against a config's interest and
+writes one digest per day. Scores are shared through the ScoreCache, so
+re-running an overlapping range only scores papers that were never seen.
+
+Usage:
+    python src/backfill.py --config config.yaml --start 2024-05-01 --end 2024-05-07
+    python src/backfill.py --config test-config.yaml --start 2024-05-01 --end 2024-05-02 \
+        --fixture-dir fixtures/oai --no-score
+"""
+import argparse
+import datetime
+import glob
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from dotenv import load_dotenv
+
+from categories import format_subjects, subjects_to_mask
+from download_new_papers import get_papers, save_papers, has_listing
+from relevancy import generate_relevance_score
+from score_cache import ScoreCache
+from budget import TokenBudget
+from batch_control import BatchSizeController
+from render import render_scored, render_listing, render_message, render_page
+from action import topic_abbr, resolve_topics, build_custom_api_config, calibration_settings, \
+    get_papers_from_multiple_topics
+
+OAI_URL = "https://export.arxiv.org/oai2"
+_OAI_NS = "{http://www.openarchives.org/OAI/2.0/}"
+_ARXIV_NS = "{http://arxiv.org/OAI/arXiv/}"
+
+# 这些领域在 OAI-PMH 中是顶层 set，其余物理类档案位于 physics:xxx 之下
+_TOP_LEVEL_SETS = {"cs", "math", "stat", "eess", "econ", "q-bio", "q-fin"}
+
+
+def _oai_set(field_abbr):
+    if field_abbr in _TOP_LEVEL_SETS:
+        return field_abbr
+    return f"physics:{field_abbr}"
+
+
+def _text(element, tag):
+    found = element.find(_ARXIV_NS + tag)
+    return " ".join(found.text.split()) if found is not None and found.text else ""
+
+
+def parse_oai_records(xml_bytes):
+    """
+    解析一页 OAI-PMH ListRecords 响应 (metadataPrefix=arXiv)
+
+    Returns:
+        tuple: ([(created_date, paper_dict), ...], resumption_token or None)
+    """
+    root = ET.fromstring(xml_bytes)
+    records = []
+    for record in root.iter(_OAI_NS + "record"):
+        header = record.find(_OAI_NS + "header")
+        if header is not None and header.get("status") == "deleted":
+            continue
+        meta = record.find(f"{_OAI_NS}metadata/{_ARXIV_NS}arXiv")
+        if meta is None:
+            continue
+
+        paper_number = _text(meta, "id")
+        authors = []
+        for author in meta.iter(_ARXIV_NS + "author"):
+            name = " ".join(part for part in (_text(author, "forenames"), _text(author, "keyname")) if part)
+            if name:
+                authors.append(name)
+        subjects = format_subjects(_text(meta, "categories").split())
+
+        created = datetime.date.fromisoformat(_text(meta, "created"))
+        records.append((created, {
+            'main_page': "https://arxiv.org/abs/" + paper_number,
+            'pdf': "https://arxiv.org/pdf/" + paper_number,
+            'title': _text(meta, "title"),
+            'authors': ", ".join(authors),
+            'subjects': subjects,
+            'abstract': _text(meta, "abstract"),
+            'subject_mask': subjects_to_mask(subjects),
+        }))
+
+    token = root.find(f"{_OAI_NS}ListRecords/{_OAI_NS}resumptionToken")
+    resumption_token = token.text.strip() if token is not None and token.text else None
+    return records, resumption_token
+
+
+class OAISource:
+    """
+    arXiv OAI-PMH 数据源，按 resumptionToken 翻页，遵守 503 Retry-After 限流
+
+    revision_margin_days: 请求的 until 比 end 晚这么多天。OAI-PMH 按最后更新日期过滤，
+    范围内提交、在此之后才修订的论文不会返回；边界越大漏掉的越少，但要多翻越多页
+    """
+
+    def __init__(self, base_url=OAI_URL, sleep_time=5, max_retries=5, revision_margin_days=14):
+        self.base_url = base_url
+        self.sleep_time = sleep_time
+        self.max_retries = max_retries
+        self.revision_margin_days = revision_margin_days
+
+    def _fetch(self, params):
+        url = self.base_url + "?" + urllib.parse.urlencode(params)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=120) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code != 503 or attempt == self.max_retries:
+                    raise
+                wait = int(e.headers.get("Retry-After", self.sleep_time))
+                print(f"⏳ OAI-PMH 限流，{wait}s 后重试...")
+                time.sleep(wait)
+
+    def records(self, field_abbr, start, end):
+        # OAI-PMH 的 from/until 按记录的 datestamp (最后更新日期) 过滤，再由 ingest_range 按 created 过滤。
+        # until 放宽 revision_margin_days，范围内提交、不久后修订的论文仍会返回；
+        # 不设 until 则要翻完该领域直到今天的全部更新记录，开销随距今天数增长
+        until = min(end + datetime.timedelta(days=self.revision_margin_days), datetime.date.today())
+        params = {
+            "verb": "ListRecords",
+            "metadataPrefix": "arXiv",
+            "set": _oai_set(field_abbr),
+            "from": start.isoformat(),
+            "until": until.isoformat(),
+        }
+        while True:
+            records, token = parse_oai_records(self._fetch(params))
+            yield from records
+            if not token:
+                break
+            params = {"verb": "ListRecords", "resumptionToken": token}
+            time.sleep(self.sleep_time)
+
+
+class FixtureSource:
+    """
+    本地替身数据源：读取 {fixture_dir}/{field_abbr}*.xml 中保存的 OAI-PMH 响应，
+    用于离线测试回填流程
+    """
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+
+    def records(self, field_abbr, start, end):
+        for path in sorted(glob.glob(os.path.join(self.fixture_dir, f"{field_abbr}*.xml"))):
+            with open(path, "rb") as f:
+                records, _ = parse_oai_records(f.read())
+            yield from records
+
+
+def date_range(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def ingest_range(field_abbrs, start, end, source, overwrite=False):
+    """
+    拉取日期范围内的论文，按首次提交日期 (created) 分组写入每日列表文件。
+    已存在的每日文件 (如当天 /new 页面抓取的结果) 默认保留不覆盖。
+
+    Returns:
+        dict: {field_abbr: {date: paper_count}}
+    """
+    summary = {}
+    for abbr in field_abbrs:
+        by_day = {}
+        seen = set()
+        for created, paper in source.records(abbr, start, end):
+            if not (start <= created <= end) or paper['main_page'] in seen:
+                continue
+            seen.add(paper['main_page'])
+            by_day.setdefault(created, []).append(paper)
+
+        summary[abbr] = {}
+        for day, papers in sorted(by_day.items()):
+            if has_listing(abbr, day) and not overwrite:
+                print(f"  {abbr} {day}: 已有列表文件或归档，跳过")
+                summary[abbr][day] = len(get_papers(abbr, date=day))
+                continue
+            save_papers(abbr, day, papers)
+            summary[abbr][day] = len(papers)
+            print(f"  {abbr} {day}: {len(papers)} 篇论文")
+    return summary
+
+
+def score_day(config, day, score_cache=None, output_dir="./digests", num_paper_in_prompt=8, score=True,
+              budget=None, batch_control=None):
+    """
+    为某一天生成 digest 并写入 {output_dir}/digest_{YYYY-MM-DD}.html
+
+    Returns:
+        tuple: (date, number of papers in the digest)
+    """
+    categories = config["categories"] if config["categories"] else []
+    papers = get_papers_from_multiple_topics(resolve_topics(config), categories, date=day)
+
+    if not papers:
+        body = render_message("No papers found matching the specified criteria.")
+        count = 0
+    elif score and config["interest"]:
+        custom_api_config, model_name = build_custom_api_config(config)
+        relevancy, hallucination = generate_relevance_score(
+            papers,
+            query={"interest": config["interest"]},
+            threshold_score=config["threshold"],
+            num_paper_in_prompt=num_paper_in_prompt,
+            model_name=model_name,
+            custom_api_config=custom_api_config,
+            score_cache=score_cache,
+            top_k=config.get("max_papers"),
+            budget=budget,
+            two_stage=config.get("two_stage", False),
+            score_batch_size=config.get("score_batch_size", 32),
+            batch_control=batch_control,
+            **calibration_settings(config)
+        )
+        body = render_scored(relevancy, hallucination)
+        count = len(relevancy)
+    else:
+        body = render_listing(papers)
+        count = len(papers)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, f"digest_{day.isoformat()}.html"), "w", encoding='utf-8') as f:
+        f.write(render_page(body, f"Backfill {day.isoformat()}")[0])
+    return day, count
+
+
+def run_backfill(config, start, end, source, workers=4, output_dir="./digests", score=True,
+                 overwrite=False, score_cache_path=None):
+    """
+    回填入口：先按领域拉取整个日期范围，再并行地按天评分并生成 digest
+    score_cache_path: 默认使用配置中的 score_cache，与日常运行共享评分缓存
+    """
+    field_abbrs = [topic_abbr(topic) for topic in resolve_topics(config)]
+    print(f"📥 拉取 {start} ~ {end} 的论文: {', '.join(field_abbrs)}")
+    ingest_range(field_abbrs, start, end, source, overwrite=overwrite)
+
+    score_cache_path = score_cache_path or config.get("score_cache") or "./data/score_cache.jsonl"
+    score_cache = ScoreCache(score_cache_path) if score else None
+    budget = TokenBudget.from_config(config) if score else None
+    batch_control = BatchSizeController.from_config(config, build_custom_api_config(config)[1]) if score else None
+    days = list(date_range(start, end))
+    print(f"🧮 使用 {workers} 个线程为 {len(days)} 天生成 digest")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda day: score_day(config, day, score_cache, output_dir, score=score, budget=budget,
+                                      batch_control=batch_control), days
+            ))
+    finally:
+        # 某一天失败时，其余天已发出的请求同样计费
+        if budget is not None:
+            budget.save()
+        if batch_control is not None:
+            batch_control.save()
+
+    print("\n" + "=" * 60)
+    print("📊 回填总结:")
+    for day, count in results:
+        print(f"  {day.isoformat()}: {count} 篇论文 -> {output_dir}/digest_{day.isoformat()}.html")
+    if budget is not None:
+        print("💰 LLM 用量:")
+        print(budget.summary())
+    if batch_control is not None:
+        print("📐 每次请求的论文数:")
+        print(batch_control.summary())
+    print("=" * 60)
+    return results
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="yaml config file to use", default="config.yaml")
+    parser.add_argument("--start", required=True, type=datetime.date.fromisoformat, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, type=datetime.date.fromisoformat, help="Last day, YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, default=4, help="Days scored in parallel")
+    parser.add_argument("--output-dir", default="./digests", help="Directory for the per-day digests")
+    parser.add_argument("--fixture-dir", help="Read OAI-PMH XML fixtures from this directory instead of arXiv")
+    parser.add_argument("--no-score", action="store_true", help="Only ingest and list papers, skip LLM scoring")
+    parser.add_argument("--overwrite", action="store_true", help="Replace existing per-day listing files")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+
+    source = FixtureSource(args.fixture_dir) if args.fixture_dir else OAISource()
+    run_backfill(config, args.start, args.end, source, workers=args.workers, output_dir=args.output_dir,
+                 score=not args.no_score, overwrite=args.overwrite)
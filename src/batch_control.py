@@ -0,0 +1,111 @@
+"""
+Adaptive prompt batch size
+
+Larger batches are cheaper per paper, since the instructions are sent once per
+request, but the model more often answers with the wrong number of items or
+runs into max_tokens. The controller grows the batch by one paper after a few
+clean responses and halves it after a misaligned or truncated one; a request
+slower than max_latency shrinks it by one. The size reached is saved per model
+in {state_dir}/batch_sizes.json and is the starting point of the next run.
+
+Config:
+    adaptive_batch:
+      min_size: 2
+      max_size: 16
+      max_latency: 90   # seconds per request (optional)
+"""
+import datetime
+import json
+import os
+import threading
+
+
+class BatchSizeController:
+    """
+    Number of papers per scoring request for one model, shared by all scoring threads of a run
+    """
+
+    def __init__(self, model_name, initial=8, min_size=2, max_size=16, max_latency=None, grow_after=2,
+                 state_dir="./state"):
+        self.model_name = model_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.grow_after = grow_after
+        self.path = os.path.join(state_dir, "batch_sizes.json")
+        self._history = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._history = json.load(f)
+        learned = self._history.get(model_name, {}).get("batch_size")
+        self.initial = self._clamp(learned or initial)
+        self.size = self.initial
+        self.batches = 0
+        self.mismatches = 0
+        self.truncations = 0
+        self.slow = 0
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, model_name, initial=8, state_dir="./state"):
+        """Controller from the config's `adaptive_batch` section, None when the section is missing"""
+        section = config.get("adaptive_batch")
+        if not section:
+            return None
+        if section is True:
+            section = {}
+        return cls(model_name, initial=initial, state_dir=state_dir,
+                   **{key: section[key] for key in ("min_size", "max_size", "max_latency") if key in section})
+
+    def _clamp(self, size):
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def observe(self, batch_size, returned_items, truncated=False, latency=None):
+        """
+        Adjust the size after one response
+        batch_size: papers sent; returned_items: items parsed from the response
+        truncated: the response stopped at max_tokens
+        """
+        with self._lock:
+            self.batches += 1
+            if truncated or returned_items != batch_size:
+                self.mismatches += returned_items != batch_size
+                self.truncations += bool(truncated)
+                self.size = self._clamp(min(self.size, batch_size) // 2)
+                self._streak = 0
+            elif self.max_latency is not None and latency is not None and latency > self.max_latency:
+                self.slow += 1
+                self.size = self._clamp(min(self.size, batch_size) - 1)
+                self._streak = 0
+            elif batch_size >= self.size:
+                # 只有满批次的成功才计入；每轮最后一个不满的批次不说明能否增大
+                self._streak += 1
+                if self._streak >= self.grow_after:
+                    self.size = self._clamp(self.size + 1)
+                    self._streak = 0
+
+    def save(self):
+        """Keep the size reached for the next run of this model"""
+        with self._lock:
+            self._history[self.model_name] = {
+                "batch_size": self.size,
+                "updated": datetime.date.today().isoformat(),
+            }
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._history, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def summary(self):
+        line = f"  {self.model_name}: {self.initial} -> {self.size} 篇/请求 ({self.batches} 个批次"
+        if self.mismatches:
+            line += f", {self.mismatches} 次条目数不一致"
+        if self.truncations:
+            line += f", {self.truncations} 次输出截断"
+        if self.slow:
+            line += f", {self.slow} 次超时"
+        return line + ")"
@@ -0,0 +1,251 @@
+"""
+LLM token and cost budget
+
+Tracks the prompt and completion tokens reported by each response, estimates
+the cost per model and checks every request against per-run and per-day
+limits before it is sent. When a limit would be exceeded, scoring stops and
+the remaining papers are ranked by a local keyword prefilter instead
+(or dropped, with on_exhausted: stop).
+
+The check reserves the request's worst case until its usage is recorded, so
+requests running concurrently (pipeline workers, backfill threads, --configs)
+cannot together overshoot a limit.
+
+Config:
+    budget:
+      max_run_tokens: 200000
+      max_run_cost: 0.50      # USD
+      max_day_cost: 2.00      # USD, summed over all runs of the day
+      on_exhausted: keywords  # or stop
+"""
+import contextvars
+import datetime
+import json
+import os
+import re
+import threading
+
+# 当前请求所属的范围 (如 --configs 中的配置序号)，asyncio 任务和 to_thread 的线程会继承
+BUDGET_SCOPE = contextvars.ContextVar("budget_scope", default=None)
+
+
+class BudgetExhausted(Exception):
+    """The next request does not fit the remaining budget"""
+
+# 每百万 token 的美元价格 (prompt, completion)
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-3.5-turbo-16k": (3.00, 4.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "deepseek-chat": (0.27, 1.10),
+    "deepseek-reasoner": (0.55, 2.19),
+}
+# 未知模型按此价格估算
+DEFAULT_PRICE = (3.00, 4.00)
+# 命中前缀缓存的 prompt token 价格，未列出的模型按普通 prompt 价格计
+CACHED_PROMPT_PRICES = {
+    "gpt-4o": 1.25,
+    "gpt-4o-mini": 0.075,
+    "deepseek-chat": 0.07,
+    "deepseek-reasoner": 0.14,
+}
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 ASCII characters per token, one token per CJK character."""
+    non_ascii = len(_NON_ASCII.findall(text))
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def _lookup(prices, model_name, default):
+    if model_name in prices:
+        return prices[model_name]
+    # 带日期后缀的模型名 (如 gpt-4o-2024-08-06) 按最长前缀匹配
+    for name in sorted(prices, key=len, reverse=True):
+        if model_name and model_name.startswith(name):
+            return prices[name]
+    return default
+
+
+def model_price(model_name):
+    return _lookup(MODEL_PRICES, model_name, DEFAULT_PRICE)
+
+
+def cached_prompt_price(model_name):
+    return _lookup(CACHED_PROMPT_PRICES, model_name, model_price(model_name)[0])
+
+
+def usage_of(response):
+    """
+    (prompt_tokens, completion_tokens, cached_tokens) reported with a completion, None when missing
+    """
+    def field(name):
+        try:
+            value = response[name]
+        except (KeyError, TypeError, IndexError):
+            value = getattr(response, name, None)
+        return value if isinstance(value, int) else None
+
+    prompt_tokens, completion_tokens = field("prompt_tokens"), field("completion_tokens")
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    return prompt_tokens, completion_tokens, min(field("cached_tokens") or 0, prompt_tokens)
+
+
+class TokenBudget:
+    """
+    Per-run and per-day LLM spend limits, shared by all scoring threads of a run.
+    The day totals are kept in {state_dir}/llm_usage.json.
+    """
+
+    def __init__(self, max_run_tokens=None, max_run_cost=None, max_day_cost=None, on_exhausted="keywords",
+                 state_dir="./state"):
+        self.max_run_tokens = max_run_tokens
+        self.max_run_cost = max_run_cost
+        self.max_day_cost = max_day_cost
+        self.on_exhausted = on_exhausted
+        self.path = os.path.join(state_dir, "llm_usage.json")
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        # 已发出、尚未记录用量的请求按最坏情况预留
+        self.reserved_tokens = 0
+        self.reserved_cost = 0.0
+        self.requests = 0
+        self.estimated = 0
+        self.skipped_papers = 0
+        # 范围 -> [prompt, completion, cached, cost]
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self._day = datetime.date.today().isoformat()
+        self._history = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._history = json.load(f)
+        self.day_cost_before = self._history.get(self._day, {}).get("cost", 0.0)
+
+    @classmethod
+    def from_config(cls, config, state_dir="./state"):
+        """Budget from the config's `budget` section, None when it has no limits"""
+        section = config.get("budget") or {}
+        limits = {key: section.get(key) for key in ("max_run_tokens", "max_run_cost", "max_day_cost")}
+        if not any(value is not None for value in limits.values()):
+            return None
+        return cls(on_exhausted=section.get("on_exhausted", "keywords"), state_dir=state_dir, **limits)
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def try_reserve(self, model_name, prompt, max_tokens):
+        """
+        Reserve the worst case of a request with this prompt (the completion using
+        all of max_tokens) if it fits the remaining budget, counting the requests
+        still in flight
+
+        Returns:
+            the reservation to pass to record() or release(), None when the request does not fit
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        prompt_price, completion_price = model_price(model_name)
+        tokens = prompt_tokens + max_tokens
+        worst_cost = (prompt_tokens * prompt_price + max_tokens * completion_price) / 1e6
+        with self._lock:
+            if self.max_run_tokens is not None \
+                    and self.total_tokens + self.reserved_tokens + tokens > self.max_run_tokens:
+                return None
+            cost = self.cost + self.reserved_cost + worst_cost
+            if self.max_run_cost is not None and cost > self.max_run_cost:
+                return None
+            if self.max_day_cost is not None and self.day_cost_before + cost > self.max_day_cost:
+                return None
+            self.reserved_tokens += tokens
+            self.reserved_cost += worst_cost
+        return tokens, worst_cost
+
+    def release(self, reservation):
+        """Give back the reservation of a request that failed"""
+        if reservation is None:
+            return
+        with self._lock:
+            self._release(reservation)
+
+    def _release(self, reservation):
+        tokens, cost = reservation
+        self.reserved_tokens -= tokens
+        self.reserved_cost = max(self.reserved_cost - cost, 0.0)
+
+    def record(self, model_name, prompt, response, reservation=None):
+        """Account for one completed request, replacing its reservation by the reported usage"""
+        usage = usage_of(response)
+        estimated = usage is None
+        if estimated:
+            completion = response.message["content"] if hasattr(response, "message") else ""
+            usage = (estimate_tokens(prompt), estimate_tokens(completion or ""), 0)
+        prompt_tokens, completion_tokens, cached_tokens = usage
+        prompt_price, completion_price = model_price(model_name)
+        cost = (prompt_tokens - cached_tokens) * prompt_price + cached_tokens * cached_prompt_price(model_name) \
+            + completion_tokens * completion_price
+        with self._lock:
+            if reservation is not None:
+                self._release(reservation)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            self.cost += cost / 1e6
+            scope = BUDGET_SCOPE.get()
+            if scope is not None:
+                spent = self._scopes.setdefault(scope, [0, 0, 0, 0.0])
+                spent[0] += prompt_tokens
+                spent[1] += completion_tokens
+                spent[2] += cached_tokens
+                spent[3] += cost / 1e6
+            self.requests += 1
+            self.estimated += estimated
+
+    def skip(self, count):
+        """Count papers left unscored because the budget ran out"""
+        with self._lock:
+            self.skipped_papers += count
+
+    def scope_cost(self, scope):
+        """Estimated cost of the requests made under one BUDGET_SCOPE value, for reporting"""
+        with self._lock:
+            return self._scopes.get(scope, (0, 0, 0, 0.0))[3]
+
+    def save(self):
+        """Add this run's spend to the day totals, including requests of runs that failed"""
+        with self._lock:
+            day = self._history.setdefault(self._day, {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            day["prompt_tokens"] += self.prompt_tokens
+            day["completion_tokens"] += self.completion_tokens
+            day["cached_tokens"] = day.get("cached_tokens", 0) + self.cached_tokens
+            day["cost"] += self.cost
+            # 只保留最近 30 天
+            self._history = dict(sorted(self._history.items())[-30:])
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._history, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def summary(self):
+        lines = [
+            f"  请求数: {self.requests}" + (f" ({self.estimated} 个按估算计)" if self.estimated else ""),
+            f"  Tokens: {self.prompt_tokens} prompt + {self.completion_tokens} completion = {self.total_tokens}",
+            f"  估算费用: ${self.cost:.4f} (今日累计 ${self.day_cost_before + self.cost:.4f})",
+        ]
+        if self.cached_tokens:
+            share = self.cached_tokens / max(self.prompt_tokens, 1)
+            lines.insert(2, f"  前缀缓存命中: {self.cached_tokens} prompt tokens ({share:.0%})")
+        if self.skipped_papers:
+            action = "按关键词排序" if self.on_exhausted == "keywords" else "未评分"
+            lines.append(f"  ⚠️ 预算用尽: {self.skipped_papers} 篇论文{action}")
+        return "\n".join(lines)
@@ -0,0 +1,403 @@
+"""
+arXiv topic/category taxonomy and precomputed subject bitmasks
+
+Each category name gets a bit in SUBJECT_VOCABULARY, so a paper's subjects can
+be parsed once (per distinct subjects string) into an integer mask and filtered
+with a single vectorized AND against a query mask. The bits follow category_map
+and are not stored: listing files are re-masked from their subjects on read.
+"""
+import functools
+
+import numpy as np
+
+topics = {
+    "Physics": "",
+    "Mathematics": "math",
+    "Computer Science": "cs",
+    "Quantitative Biology": "q-bio",
+    "Quantitative Finance": "q-fin",
+    "Statistics": "stat",
+    "Electrical Engineering and Systems Science": "eess",
+    "Economics": "econ",
+}
+
+physics_topics = {
+    "Astrophysics": "astro-ph",
+    "Condensed Matter": "cond-mat",
+    "General Relativity and Quantum Cosmology": "gr-qc",
+    "High Energy Physics - Experiment": "hep-ex",
+    "High Energy Physics - Lattice": "hep-lat",
+    "High Energy Physics - Phenomenology": "hep-ph",
+    "High Energy Physics - Theory": "hep-th",
+    "Mathematical Physics": "math-ph",
+    "Nonlinear Sciences": "nlin",
+    "Nuclear Experiment": "nucl-ex",
+    "Nuclear Theory": "nucl-th",
+    "Physics": "physics",
+    "Quantum Physics": "quant-ph",
+}
+
+# TODO: surely theres a better way
+category_map = {
+    "Astrophysics": [
+        "Astrophysics of Galaxies",
+        "Cosmology and Nongalactic Astrophysics",
+        "Earth and Planetary Astrophysics",
+        "High Energy Astrophysical Phenomena",
+        "Instrumentation and Methods for Astrophysics",
+        "Solar and Stellar Astrophysics",
+    ],
+    "Condensed Matter": [
+        "Disordered Systems and Neural Networks",
+        "Materials Science",
+        "Mesoscale and Nanoscale Physics",
+        "Other Condensed Matter",
+        "Quantum Gases",
+        "Soft Condensed Matter",
+        "Statistical Mechanics",
+        "Strongly Correlated Electrons",
+        "Superconductivity",
+    ],
+    "General Relativity and Quantum Cosmology": ["None"],
+    "High Energy Physics - Experiment": ["None"],
+    "High Energy Physics - Lattice": ["None"],
+    "High Energy Physics - Phenomenology": ["None"],
+    "High Energy Physics - Theory": ["None"],
+    "Mathematical Physics": ["None"],
+    "Nonlinear Sciences": [
+        "Adaptation and Self-Organizing Systems",
+        "Cellular Automata and Lattice Gases",
+        "Chaotic Dynamics",
+        "Exactly Solvable and Integrable Systems",
+        "Pattern Formation and Solitons",
+    ],
+    "Nuclear Experiment": ["None"],
+    "Nuclear Theory": ["None"],
+    "Physics": [
+        "Accelerator Physics",
+        "Applied Physics",
+        "Atmospheric and Oceanic Physics",
+        "Atomic and Molecular Clusters",
+        "Atomic Physics",
+        "Biological Physics",
+        "Chemical Physics",
+        "Classical Physics",
+        "Computational Physics",
+        "Data Analysis, Statistics and Probability",
+        "Fluid Dynamics",
+        "General Physics",
+        "Geophysics",
+        "History and Philosophy of Physics",
+        "Instrumentation and Detectors",
+        "Medical Physics",
+        "Optics",
+        "Physics and Society",
+        "Physics Education",
+        "Plasma Physics",
+        "Popular Physics",
+        "Space Physics",
+    ],
+    "Quantum Physics": ["None"],
+    "Mathematics": [
+        "Algebraic Geometry",
+        "Algebraic Topology",
+        "Analysis of PDEs",
+        "Category Theory",
+        "Classical Analysis and ODEs",
+        "Combinatorics",
+        "Commutative Algebra",
+        "Complex Variables",
+        "Differential Geometry",
+        "Dynamical Systems",
+        "Functional Analysis",
+        "General Mathematics",
+        "General Topology",
+        "Geometric Topology",
+        "Group Theory",
+        "History and Overview",
+        "Information Theory",
+        "K-Theory and Homology",
+        "Logic",
+        "Mathematical Physics",
+        "Metric Geometry",
+        "Number Theory",
+        "Numerical Analysis",
+        "Operator Algebras",
+        "Optimization and Control",
+        "Probability",
+        "Quantum Algebra",
+        "Representation Theory",
+        "Rings and Algebras",
+        "Spectral Theory",
+        "Statistics Theory",
+        "Symplectic Geometry",
+    ],
+    "Computer Science": [
+        "Artificial Intelligence",
+        "Computation and Language",
+        "Computational Complexity",
+        "Computational Engineering, Finance, and Science",
+        "Computational Geometry",
+        "Computer Science and Game Theory",
+        "Computer Vision and Pattern Recognition",
+        "Computers and Society",
+        "Cryptography and Security",
+        "Data Structures and Algorithms",
+        "Databases",
+        "Digital Libraries",
+        "Discrete Mathematics",
+        "Distributed, Parallel, and Cluster Computing",
+        "Emerging Technologies",
+        "Formal Languages and Automata Theory",
+        "General Literature",
+        "Graphics",
+        "Hardware Architecture",
+        "Human-Computer Interaction",
+        "Information Retrieval",
+        "Information Theory",
+        "Logic in Computer Science",
+        "Machine Learning",
+        "Mathematical Software",
+        "Multiagent Systems",
+        "Multimedia",
+        "Networking and Internet Architecture",
+        "Neural and Evolutionary Computing",
+        "Numerical Analysis",
+        "Operating Systems",
+        "Other Computer Science",
+        "Performance",
+        "Programming Languages",
+        "Robotics",
+        "Social and Information Networks",
+        "Software Engineering",
+        "Sound",
+        "Symbolic Computation",
+        "Systems and Control",
+    ],
+    "Quantitative Biology": [
+        "Biomolecules",
+        "Cell Behavior",
+        "Genomics",
+        "Molecular Networks",
+        "Neurons and Cognition",
+        "Other Quantitative Biology",
+        "Populations and Evolution",
+        "Quantitative Methods",
+        "Subcellular Processes",
+        "Tissues and Organs",
+    ],
+    "Quantitative Finance": [
+        "Computational Finance",
+        "Economics",
+        "General Finance",
+        "Mathematical Finance",
+        "Portfolio Management",
+        "Pricing of Securities",
+        "Risk Management",
+        "Statistical Finance",
+        "Trading and Market Microstructure",
+    ],
+    "Statistics": [
+        "Applications",
+        "Computation",
+        "Machine Learning",
+        "Methodology",
+        "Other Statistics",
+        "Statistics Theory",
+    ],
+    "Electrical Engineering and Systems Science": [
+        "Audio and Speech Processing",
+        "Image and Video Processing",
+        "Signal Processing",
+        "Systems and Control",
+    ],
+    "Economics": ["Econometrics", "General Economics", "Theoretical Economics"],
+}
+
+
+# arXiv 分类代码前缀，以及与 category_map 中名称顺序一一对应的代码后缀
+# (列表页显示 "Machine Learning (cs.LG)"，OAI-PMH 等接口只给出 "cs.LG")
+_ARCHIVE_PREFIXES = {
+    "Astrophysics": "astro-ph",
+    "Condensed Matter": "cond-mat",
+    "Nonlinear Sciences": "nlin",
+    "Physics": "physics",
+    "Mathematics": "math",
+    "Computer Science": "cs",
+    "Quantitative Biology": "q-bio",
+    "Quantitative Finance": "q-fin",
+    "Statistics": "stat",
+    "Electrical Engineering and Systems Science": "eess",
+    "Economics": "econ",
+}
+_CATEGORY_SUFFIXES = {
+    "Astrophysics": "GA CO EP HE IM SR",
+    "Condensed Matter": "dis-nn mtrl-sci mes-hall other quant-gas soft stat-mech str-el supr-con",
+    "Nonlinear Sciences": "AO CG CD SI PS",
+    "Physics": "acc-ph app-ph ao-ph atm-clus atom-ph bio-ph chem-ph class-ph comp-ph data-an flu-dyn gen-ph "
+               "geo-ph hist-ph ins-det med-ph optics soc-ph ed-ph plasm-ph pop-ph space-ph",
+    "Mathematics": "AG AT AP CT CA CO AC CV DG DS FA GM GN GT GR HO IT KT LO MP MG NT NA OA OC PR QA RT RA "
+                   "SP ST SG",
+    "Computer Science": "AI CL CC CE CG GT CV CY CR DS DB DL DM DC ET FL GL GR AR HC IR IT LO LG MS MA MM NI "
+                        "NE NA OS OH PF PL RO SI SE SD SC SY",
+    "Quantitative Biology": "BM CB GN MN NC OT PE QM SC TO",
+    "Quantitative Finance": "CP EC GN MF PM PR RM ST TR",
+    "Statistics": "AP CO ML ME OT TH",
+    "Electrical Engineering and Systems Science": "AS IV SP SY",
+    "Economics": "EM GN TH",
+}
+
+
+def _build_category_names():
+    names = {}
+    for topic, suffixes in _CATEGORY_SUFFIXES.items():
+        suffixes = suffixes.split()
+        assert len(suffixes) == len(category_map[topic]), topic
+        for suffix, name in zip(suffixes, category_map[topic]):
+            names[f"{_ARCHIVE_PREFIXES[topic]}.{suffix}"] = name
+    # 没有子类别的独立档案 (gr-qc, quant-ph, ...) 直接使用主题名
+    for topic, abbr in physics_topics.items():
+        if category_map.get(topic) == ["None"]:
+            names[abbr] = topic
+    return names
+
+
+# arXiv 分类代码 -> 类别名称，如 "cs.LG" -> "Machine Learning"
+CATEGORY_NAMES = _build_category_names()
+
+
+def format_subjects(codes):
+    """
+    将分类代码列表格式化为列表页同样的 subjects 字符串，
+    如 ["cs.LG", "cs.AI"] -> "Machine Learning (cs.LG); Artificial Intelligence (cs.AI)"
+    """
+    return "; ".join(
+        f"{CATEGORY_NAMES[code]} ({code})" if code in CATEGORY_NAMES else code
+        for code in codes
+    )
+
+# 所有类别名称的顺序；位置即 bit 编号。没有子类别的独立档案 (quant-ph, hep-th, ...) 的论文
+# 在 subjects 中以主题名出现，按主题名分配 bit。
+# bit 编号随 category_map 的修改而变化，只在进程内有效：从列表文件读回的论文按 subjects 重新计算 mask
+SUBJECT_VOCABULARY = tuple(dict.fromkeys(
+    name
+    for topic, names in category_map.items()
+    for name in (names if names != ["None"] else [topic])
+))
+SUBJECT_IDS = {name: idx for idx, name in enumerate(SUBJECT_VOCABULARY)}
+MASK_WORDS = (len(SUBJECT_VOCABULARY) + 63) // 64
+_WORD_BITS = (1 << 64) - 1
+
+
+def process_subject_fields(subjects):
+    """
+    增强版的subjects字段处理函数
+    修复了处理"Subjects:"前缀和换行符的问题
+    """
+    if not subjects:
+        return []
+
+    # 处理换行符和多余空格
+    subjects = subjects.replace('\n', ' ').strip()
+
+    # 去掉可能的"Subjects:"前缀
+    if subjects.startswith('Subjects:'):
+        subjects = subjects[9:].strip()
+
+    # 按分号分割
+    all_subjects = subjects.split(";")
+
+    # 清理每个subject
+    cleaned_subjects = []
+    for s in all_subjects:
+        # 去掉前后空格
+        s = s.strip()
+        # 去掉括号及其内容
+        if " (" in s:
+            s = s.split(" (")[0].strip()
+        # 只添加非空的subject
+        if s:
+            cleaned_subjects.append(s)
+
+    return cleaned_subjects
+
+
+def subjects_to_mask(subjects):
+    """
+    将 subjects 字段 (原始字符串或类别名列表) 编码为整数 bitmask，未知类别被忽略
+    """
+    if isinstance(subjects, str):
+        return _subject_string_mask(subjects)
+    mask = 0
+    for name in subjects:
+        idx = SUBJECT_IDS.get(name)
+        if idx is not None:
+            mask |= 1 << idx
+    return mask
+
+
+@functools.lru_cache(maxsize=8192)
+def _subject_string_mask(subjects):
+    # 同一列表中大量论文的 subjects 字符串相同，按字符串缓存
+    return subjects_to_mask(process_subject_fields(subjects))
+
+
+def paper_subject_mask(paper):
+    """
+    返回论文的 subject_mask；旧数据文件中没有该字段时现场计算并缓存到字典中
+    """
+    mask = paper.get("subject_mask")
+    if mask is None:
+        mask = paper["subject_mask"] = subjects_to_mask(paper.get("subjects", ""))
+    return mask
+
+
+def _mask_to_words(mask):
+    return [(mask >> (64 * word)) & _WORD_BITS for word in range(MASK_WORDS)]
+
+
+def build_mask_matrix(papers):
+    """
+    将论文列表的 subject_mask 列转换为 (n, MASK_WORDS) 的 uint64 矩阵
+    """
+    return mask_matrix([paper_subject_mask(paper) for paper in papers])
+
+
+def mask_matrix(masks):
+    """
+    将整数 bitmask 列表转换为 (n, MASK_WORDS) 的 uint64 矩阵
+    """
+    matrix = np.zeros((len(masks), MASK_WORDS), dtype=np.uint64)
+    for row, mask in enumerate(masks):
+        matrix[row] = _mask_to_words(mask)
+    return matrix
+
+
+def query_mask(categories):
+    """
+    将查询类别列表编码为 (MASK_WORDS,) 的 uint64 向量
+    """
+    unknown = [name for name in categories if name not in SUBJECT_IDS]
+    if unknown:
+        print(f"⚠️ 未知类别将被忽略: {unknown}")
+    return np.array(_mask_to_words(subjects_to_mask(categories)), dtype=np.uint64)
+
+
+def subject_filter_mask(matrix, categories):
+    """
+    返回布尔向量，标记矩阵中与任一查询类别相交的行
+    """
+    return (matrix & query_mask(categories)).any(axis=1)
+
+
+def filter_papers_by_subjects(papers, categories, matrix=None):
+    """
+    按类别过滤论文，等价于逐篇计算 set(subjects) & set(categories)
+    matrix: 可选的预计算 mask 矩阵 (与 papers 一一对应)
+    """
+    if not papers:
+        return []
+    if matrix is None:
+        matrix = build_mask_matrix(papers)
+    selected = np.flatnonzero(subject_filter_mask(matrix, categories))
+    return [papers[i] for i in selected]
@@ -1,115 +1,356 @@
 # encoding: utf-8
+import collections
 import os
+import threading
 import tqdm
-from bs4 import BeautifulSoup as bs
 import urllib.request
 import json
 import datetime
 import pytz
 import re
+from concurrent.futures import ProcessPoolExecutor
 
+from categories import mask_matrix, subject_filter_mask
+from paper import Paper
 
-def _download_new_papers(field_abbr):
-    NEW_SUB_URL = f'https://arxiv.org/list/{field_abbr}/new'  # https://arxiv.org/list/cs/new
-    page = urllib.request.urlopen(NEW_SUB_URL)
-    soup = bs(page)
-    content = soup.body.find("div", {'id': 'content'})
 
-    # find the first h3 element in content
-    h3 = content.find("h3").text  # e.g: New submissions for Wed, 10 May 23
-    date = h3.replace("New submissions for", "").strip()
+# 预编译的正则表达式，避免在逐篇论文的循环中重复编译
+ARXIV_ID_PATTERN = re.compile(r'arXiv:(\d{4}\.\d{4,5})')
+BARE_ID_PATTERN = re.compile(r'(?:^|:)(\d{4}\.\d{4,5})$')
+
+# 进程内缓存的已解析列表数量 (按 (领域, 日期) 计)
+LISTING_CACHE_SIZE = 32
+
+# 每日文件被 archive.py compact --remove-daily 删除后，从这里的归档读取历史列表
+ARCHIVE_DIR = os.environ.get("ARXIV_DIGEST_ARCHIVE_DIR", "./archive")
+
+# 解析列表页面的进程数，0 表示在下载线程中直接解析 (见 set_parse_workers)
+PARSE_WORKERS = int(os.environ.get("ARXIV_DIGEST_PARSE_WORKERS", "0"))
+
+# <dd> 中各字段对应的 class，一次遍历即可全部取出
+_FIELD_CLASSES = {
+    "list-title mathjax": "title",
+    "list-authors": "authors",
+    "list-subjects": "subjects",
+    "mathjax": "abstract",
+}
+
+
+def paper_id(paper):
+    """
+    论文的 arXiv 编号，由 main_page 链接推出 (如 2405.01234)
+    """
+    return paper['main_page'].rsplit('/', 1)[-1]
+
+
+def _extract_paper_number(dt):
+    """
+    从 <dt> 元素中提取论文编号，按可靠性依次尝试：链接href、链接文本、dt文本
+    """
+    link_element = dt.find("a", href=True)
+    if link_element is not None:
+        href = link_element['href']
+        if href.startswith('/abs/'):
+            return href[5:]
+        arxiv_match = ARXIV_ID_PATTERN.search(link_element.text)
+        if arxiv_match:
+            return arxiv_match.group(1)
+
+    dt_text = dt.text
+    arxiv_match = ARXIV_ID_PATTERN.search(dt_text)
+    if arxiv_match:
+        return arxiv_match.group(1)
+
+    # 最后的备用方法：逐词匹配 "xxx:XXXX.XXXXX"
+    for part in dt_text.split():
+        bare_match = BARE_ID_PATTERN.search(part)
+        if bare_match and ':' in part:
+            return bare_match.group(1)
+    return None
+
+
+def _extract_fields(dd):
+    """
+    一次遍历 <dd> 的子元素，取出 title/authors/subjects/abstract 的原始文本
+    """
+    fields = {}
+    for element in dd.find_all(("div", "p")):
+        css_class = element.get("class")
+        if not css_class:
+            continue
+        key = _FIELD_CLASSES.get(" ".join(css_class))
+        if key is None or key in fields:
+            continue
+        if key == "abstract" and element.name != "p":
+            continue
+        fields[key] = element.text
+        if len(fields) == len(_FIELD_CLASSES):
+            break
+    return fields
+
+
+def _entry_record(dt, dd, index=0):
+    """
+    解析单个 <dt>/<dd> 条目为紧凑的元组 (编号, 标题, 作者, 学科, 摘要)
+    """
+    paper_number = _extract_paper_number(dt)
+
+    # 如果仍然没有找到论文编号，使用一个默认值并记录错误
+    if not paper_number:
+        print(f"警告: 无法提取第 {index + 1} 篇论文的编号，dt文本: {dt.text.strip()}")
+        paper_number = f"unknown_{index}"  # 临时编号，避免程序崩溃
+
+    fields = _extract_fields(dd)
+    return (
+        paper_number,
+        fields.get("title", "").replace("Title: ", "").strip(),
+        fields.get("authors", "").replace("Authors:\n", "").replace("\n", "").strip(),
+        fields.get("subjects", "").replace("Subjects: ", "").strip(),
+        fields.get("abstract", "").replace("\n", " ").strip(),
+    )
+
+
+def _parse_paper_entry(dt, dd, index=0):
+    """
+    解析单个 <dt>/<dd> 条目为论文字典
+    """
+    return Paper.from_record(_entry_record(dt, dd, index)).to_dict()
+
+
+def _parse_page_records(page, progress=False):
+    """
+    解析 arXiv /new 列表页面 (HTML 文本或字节)，按页面顺序返回条目元组；
+    在解析进程中运行，返回值只含字符串，序列化开销小
+    """
+    # BeautifulSoup 只在真正解析页面时才导入，读取已保存的列表文件无需加载
+    from bs4 import BeautifulSoup as bs
+
+    soup = bs(page, "html.parser")
+    content = soup.body.find("div", {'id': 'content'})
 
     dt_list = content.dl.find_all("dt")
     dd_list = content.dl.find_all("dd")
-    arxiv_base = "https://arxiv.org/abs/"
 
     assert len(dt_list) == len(dd_list)
-    new_paper_list = []
-    for i in tqdm.tqdm(range(len(dt_list))):
-        paper = {}
-
-        # 改进的论文编号提取逻辑
-        paper_number = None
-
-        # 方法1: 从HTML链接中提取 (最可靠)
-        link_element = dt_list[i].find("a", href=True)
-        if link_element:
-            href = link_element.get('href')
-            if href and href.startswith('/abs/'):
-                paper_number = href[5:]  # 去掉 "/abs/" 前缀
-                print(f"从链接提取论文编号: {paper_number}")
-
-        # 方法2: 从链接文本中提取
-        if not paper_number and link_element:
-            link_text = link_element.text.strip()
-            # 匹配 arXiv:XXXX.XXXXX 格式
-            arxiv_match = re.search(r'arXiv:(\d{4}\.\d{4,5})', link_text)
-            if arxiv_match:
-                paper_number = arxiv_match.group(1)
-                print(f"从链接文本提取论文编号: {paper_number}")
-
-        # 方法3: 从整个dt元素文本中提取 (备用方法)
-        if not paper_number:
-            dt_text = dt_list[i].text.strip()
-            # 使用正则表达式匹配 arXiv:XXXX.XXXXX 格式
-            arxiv_match = re.search(r'arXiv:(\d{4}\.\d{4,5})', dt_text)
-            if arxiv_match:
-                paper_number = arxiv_match.group(1)
-                print(f"从dt文本提取论文编号: {paper_number}")
-            else:
-                # 最后的备用方法：尝试原始的分割逻辑
-                try:
-                    parts = dt_text.split()
-                    for part in parts:
-                        if ':' in part and ('arXiv:' in part or re.match(r'\d{4}\.\d{4,5}', part.split(':')[-1])):
-                            paper_number = part.split(":")[-1]
-                            print(f"从分割文本提取论文编号: {paper_number}")
-                            break
-                except:
-                    pass
-
-        # 如果仍然没有找到论文编号，使用一个默认值并记录错误
-        if not paper_number:
-            print(f"警告: 无法提取第 {i + 1} 篇论文的编号，dt文本: {dt_list[i].text.strip()}")
-            paper_number = f"unknown_{i}"  # 临时编号，避免程序崩溃
-
-        # 构建链接
-        paper['main_page'] = arxiv_base + paper_number
-        paper['pdf'] = arxiv_base.replace('abs', 'pdf') + paper_number
-
-        # 提取其他信息
-        paper['title'] = dd_list[i].find("div", {"class": "list-title mathjax"}).text.replace("Title: ", "").strip()
-        paper['authors'] = dd_list[i].find("div", {"class": "list-authors"}).text \
-            .replace("Authors:\n", "").replace("\n", "").strip()
-        paper['subjects'] = dd_list[i].find("div", {"class": "list-subjects"}).text.replace("Subjects: ", "").strip()
-        paper['abstract'] = dd_list[i].find("p", {"class": "mathjax"}).text.replace("\n", " ").strip()
-
-        new_paper_list.append(paper)
+    return [
+        _entry_record(dt, dd, i)
+        for i, (dt, dd) in enumerate(tqdm.tqdm(zip(dt_list, dd_list), total=len(dt_list), disable=not progress))
+    ]
+
+
+def _parse_new_papers(page, progress=True):
+    """
+    解析 arXiv /new 列表页面 (HTML 文本或字节)，返回论文字典列表
+    """
+    return [Paper.from_record(record).to_dict() for record in _parse_page_records(page, progress)]
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def set_parse_workers(workers):
+    """
+    在 workers 个进程中解析下载的列表页面 (BeautifulSoup 解析受 GIL 限制，多领域时按核数扩展)；
+    0 表示在下载线程中直接解析
+    """
+    global PARSE_WORKERS, _parse_pool
+    with _parse_pool_lock:
+        if workers != PARSE_WORKERS and _parse_pool is not None:
+            _parse_pool.shutdown(wait=False)
+            _parse_pool = None
+        PARSE_WORKERS = workers
 
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _parse_pool
+
+
+def parse_listing_page(page):
+    """
+    解析列表页面为论文字典列表；启用了解析进程池时，原始字节送入子进程，只传回条目元组。
+    结果与单进程解析完全一致
+    """
+    if PARSE_WORKERS <= 0:
+        return _parse_new_papers(page)
+    records = _get_parse_pool().submit(_parse_page_records, page).result()
+    return [Paper.from_record(record).to_dict() for record in records]
+
+
+def _today():
+    return datetime.date.fromtimestamp(datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp())
+
+
+def _data_path(field_abbr, date, data_dir="./data"):
+    """
+    某个领域某一天的列表文件路径，如 ./data/cs_Wed, 15 May 24.jsonl
+    """
+    return f"{data_dir}/{field_abbr}_{date.strftime('%a, %d %b %y')}.jsonl"
+
+
+def save_papers(field_abbr, date, papers, data_dir="./data"):
+    """
+    将论文列表保存为jsonl文件，每行一个论文字典
+    """
     #  check if ./data exist, if not, create it
-    if not os.path.exists("./data"):
-        os.makedirs("./data")
-
-    # save new_paper_list to a jsonl file, with each line as the element of a dictionary
-    date = datetime.date.fromtimestamp(datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp())
-    date = date.strftime("%a, %d %b %y")
-    with open(f"./data/{field_abbr}_{date}.jsonl", "w") as f:
-        for paper in new_paper_list:
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    with open(_data_path(field_abbr, date, data_dir), "w") as f:
+        for paper in papers:
             f.write(json.dumps(paper) + "\n")
 
 
-def get_papers(field_abbr, limit=None):
-    date = datetime.date.fromtimestamp(datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp())
-    date = date.strftime("%a, %d %b %y")
-    if not os.path.exists(f"./data/{field_abbr}_{date}.jsonl"):
-        _download_new_papers(field_abbr)
-    results = []
-    with open(f"./data/{field_abbr}_{date}.jsonl", "r") as f:
-        for i, line in enumerate(f.readlines()):
-            if limit and i == limit:
-                return results
-            results.append(json.loads(line))
-    return results
+def _download_new_papers(field_abbr):
+    NEW_SUB_URL = f'https://arxiv.org/list/{field_abbr}/new'  # https://arxiv.org/list/cs/new
+    page = urllib.request.urlopen(NEW_SUB_URL).read()
+    new_paper_list = parse_listing_page(page)
+    save_papers(field_abbr, _today(), new_paper_list)
+
+
+class Listing:
+    """
+    一个领域某一天的已解析论文列表 (paper.Paper 记录)，附带预计算的 subject mask 矩阵。
+    按类别查询的结果 (行号) 也会缓存，界面中反复切换类别时无需重新计算。
+    """
+
+    def __init__(self, papers):
+        self.papers = papers
+        self.matrix = mask_matrix([paper.subject_mask for paper in papers])
+        self._selections = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.papers)
+
+    def indices(self, categories):
+        key = tuple(sorted(categories))
+        with self._lock:
+            selected = self._selections.get(key)
+        if selected is None:
+            selected = subject_filter_mask(self.matrix, categories).nonzero()[0].tolist() if self.papers else []
+            with self._lock:
+                self._selections[key] = selected
+        return selected
+
+    def filter(self, categories=None, limit=None):
+        """
+        返回 (按类别过滤后的) 论文字典，调用方可以自由修改
+        """
+        if categories:
+            papers = [self.papers[i] for i in self.indices(categories)[:limit]]
+        else:
+            papers = self.papers[:limit]
+        return [paper.to_dict() for paper in papers]
+
+
+_listing_cache = collections.OrderedDict()
+_listing_lock = threading.Lock()
+# 每个领域一把下载锁：同一领域只下载一次，不同领域可以并发下载和解析
+_download_locks = {}
+
+
+def _download_lock(field_abbr):
+    with _listing_lock:
+        return _download_locks.setdefault(field_abbr, threading.Lock())
+
+
+# 已打开的归档: {archive_dir: (meta.json 的 (mtime, 大小), PaperArchive)}
+_archives = {}
+
+
+def _read_listing(path):
+    with open(path, "r") as f:
+        return Listing([Paper.from_dict(json.loads(line)) for line in f])
+
+
+def _open_archive(archive_dir):
+    """
+    返回 (stamp, PaperArchive)，归档不存在时返回 None。重新 compact 后 meta.json 变化，自动重新打开
+    """
+    try:
+        stat = os.stat(os.path.join(archive_dir, "meta.json"))
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _listing_lock:
+        cached = _archives.get(archive_dir)
+    if cached is not None and cached[0] == stamp:
+        return cached
+    # numpy 只在读取归档时需要
+    from archive import PaperArchive
+    opened = (stamp, PaperArchive(archive_dir))
+    with _listing_lock:
+        _archives[archive_dir] = opened
+    return opened
+
+
+def _archived_papers(archive, field_abbr, date):
+    # 归档中同一天的论文按编号排序，与 /new 页面的顺序不同
+    return [archive.paper(i) for i in archive.select(date, date, [field_abbr])]
+
+
+def has_listing(field_abbr, date):
+    """
+    某领域某一天是否已有存储的列表 (每日文件或归档)
+    """
+    if os.path.exists(_data_path(field_abbr, date)):
+        return True
+    opened = _open_archive(ARCHIVE_DIR)
+    return opened is not None and len(opened[1].select(date, date, [field_abbr])) > 0
+
+
+def get_listing(field_abbr, date=None):
+    """
+    读取某领域的论文列表；date 为空时使用今天的列表 (不存在则下载)，
+    否则读取已存储的当天文件 (如回填生成的文件)，没有当天文件时从 ARCHIVE_DIR 的归档读取，
+    都没有时返回空列表。
+    解析结果按 (领域, 日期) 做 LRU 缓存，文件或归档被改写 (mtime/大小变化) 后自动失效
+    """
+    if date is None:
+        date = _today()
+        with _download_lock(field_abbr):
+            if not os.path.exists(_data_path(field_abbr, date)):
+                _download_new_papers(field_abbr)
+
+    path = _data_path(field_abbr, date)
+    if os.path.exists(path):
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        load = lambda: _read_listing(path)
+    else:
+        opened = _open_archive(ARCHIVE_DIR)
+        if opened is None:
+            return Listing([])
+        stamp, archive = opened
+        stamp = ("archive",) + stamp
+        load = lambda: Listing([Paper.from_dict(paper) for paper in _archived_papers(archive, field_abbr, date)])
+
+    key = (field_abbr, date)
+    with _listing_lock:
+        cached = _listing_cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            _listing_cache.move_to_end(key)
+            return cached[1]
+
+    listing = load()
+    with _listing_lock:
+        _listing_cache[key] = (stamp, listing)
+        _listing_cache.move_to_end(key)
+        while len(_listing_cache) > LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return listing
+
+
+def get_papers(field_abbr, limit=None, date=None, categories=None):
+    """
+    返回论文字典列表 (副本)，见 get_listing；categories 非空时只保留相交的论文
+    """
+    return get_listing(field_abbr, date).filter(categories, limit)
 
 
 def test_paper_extraction():
@@ -146,6 +387,111 @@ def test_paper_extraction():
         return False
 
 
+def _synthetic_listing(num_entries):
+    """
+    生成与 arXiv /new 页面结构一致的合成HTML，用于离线基准测试
+    """
+    entries = []
+    for i in range(num_entries):
+        paper_number = f"2405.{i:05d}"
+        entries.append(
+            f'<dt><a name="item{i + 1}">[{i + 1}]</a> '
+            f'<span class="list-identifier"><a href="/abs/{paper_number}" title="Abstract">arXiv:{paper_number}</a> '
+            f'[<a href="/pdf/{paper_number}" title="Download PDF">pdf</a>]</span></dt>\n'
+            f'<dd><div class="meta">'
+            f'<div class="list-title mathjax"><span class="descriptor">Title:</span> Synthetic Paper {i}</div>\n'
+            f'<div class="list-authors"><span class="descriptor">Authors:</span>\n<a href="#">Alice</a>, <a href="#">Bob</a></div>\n'
+            f'<div class="list-comments mathjax"><span class="descriptor">Comments:</span> 10 pages</div>\n'
+            f'<div class="list-subjects"><span class="descriptor">Subjects:</span> '
+            f'<span class="primary-subject">Machine Learning (cs.LG)</span>; Artificial Intelligence (cs.AI)</div>\n'
+            f'<p class="mathjax">An abstract for synthetic paper {i}\nspanning two lines.</p>'
+            f'</div></dd>\n'
+        )
+    return (
+        '<html><body><div id="content"><h3>New submissions for Wed, 15 May 24</h3><dl>\n'
+        + "".join(entries)
+        + '</dl></div></body></html>'
+    )
+
+
+def benchmark_extraction(num_entries=2000, repeat=3):
+    """
+    论文条目解析的微基准测试，输出每个条目的平均耗时
+    """
+    import time
+    from bs4 import BeautifulSoup as bs
+
+    page = _synthetic_listing(num_entries)
+    soup = bs(page, "html.parser")
+    dl = soup.body.find("div", {'id': 'content'}).dl
+    pairs = list(zip(dl.find_all("dt"), dl.find_all("dd")))
+
+    print(f"⏱️ 基准测试: {num_entries} 个条目, 重复 {repeat} 次")
+    best_entry = best_page = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i, (dt, dd) in enumerate(pairs):
+            _parse_paper_entry(dt, dd, i)
+        best_entry = min(best_entry, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        papers = _parse_new_papers(page, progress=False)
+        best_page = min(best_page, time.perf_counter() - start)
+
+    assert len(papers) == num_entries and papers[0]['main_page'].endswith("2405.00000")
+    print(f"  条目提取: {best_entry / num_entries * 1e6:.1f} µs/条目")
+    print(f"  整页解析: {best_page / num_entries * 1e6:.1f} µs/条目 (含HTML解析)")
+    return best_entry / num_entries, best_page / num_entries
+
+
+def benchmark_parse_pool(num_pages=12, num_entries=1000, workers=4):
+    """
+    多领域列表解析的基准测试：num_pages 个页面依次在当前进程中解析，与 workers 个解析进程并行解析对比
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    pages = [_synthetic_listing(num_entries).encode("utf-8") for _ in range(num_pages)]
+    print(f"⏱️ 基准测试: {num_pages} 个页面 × {num_entries} 个条目, {workers} 个解析进程")
+
+    previous = PARSE_WORKERS
+    try:
+        set_parse_workers(0)
+        start = time.perf_counter()
+        serial = [_parse_new_papers(page, progress=False) for page in pages]
+        serial_time = time.perf_counter() - start
+
+        set_parse_workers(workers)
+        _get_parse_pool().submit(int).result()  # 先启动进程池，不计入解析时间
+        start = time.perf_counter()
+        # 与流水线一样，每个领域在自己的下载线程中解析
+        with ThreadPoolExecutor(max_workers=num_pages) as executor:
+            pooled = list(executor.map(parse_listing_page, pages))
+        pooled_time = time.perf_counter() - start
+    finally:
+        set_parse_workers(previous)
+
+    assert pooled == serial
+    print(f"  单进程: {serial_time:.2f}s")
+    print(f"  进程池: {pooled_time:.2f}s ({serial_time / pooled_time:.1f}x, 结果一致)")
+    return serial_time, pooled_time
+
+
 if __name__ == "__main__":
-    # 运行测试
-    test_paper_extraction()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="Run the offline extraction micro-benchmark")
+    parser.add_argument("--entries", type=int, default=2000, help="Number of synthetic entries for the benchmark")
+    parser.add_argument("--parse-workers", type=int,
+                        help="With --benchmark, compare parsing --pages listings in this many processes")
+    parser.add_argument("--pages", type=int, default=12, help="Number of synthetic listings for --parse-workers")
+    args = parser.parse_args()
+
+    if args.benchmark and args.parse_workers:
+        benchmark_parse_pool(args.pages, args.entries, args.parse_workers)
+    elif args.benchmark:
+        benchmark_extraction(args.entries)
+    else:
+        # 运行测试
+        test_paper_extraction()
\ No newline at end of file
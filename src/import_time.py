@@ -0,0 +1,95 @@
+"""
+Import-time benchmark
+
+Imports each module in a fresh interpreter with `python -X importtime`, parses
+the per-module timings from stderr and reports the total and the heaviest
+dependencies. Heavy SDKs must stay out of the cold import path, so the check
+fails when one of them is loaded, or when a module exceeds --max-ms.
+
+Usage:
+    python src/import_time.py
+    python src/import_time.py action mailer --max-ms 400 --top 15
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# 这些库只应在对应代码路径上按需导入
+HEAVY_MODULES = ("openai", "sendgrid", "gradio", "bs4", "smtplib", "yaml")
+DEFAULT_MODULES = ("action", "relevancy", "mailer", "download_new_papers")
+
+# import time:     self [us] |  cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def measure(module, runs=3):
+    """
+    Import `module` in fresh interpreters and keep the fastest run
+
+    Returns:
+        tuple: (total cumulative microseconds, {imported module: cumulative microseconds})
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=src_dir, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+        # 输出按后序排列：模块自己的依赖紧挨在它之前，上一个顶层条目 (如 site) 之后
+        timings, pending = {}, {}
+        for line in result.stderr.splitlines():
+            match = _LINE.match(line)
+            if not match:
+                continue
+            name, cumulative = match.group(4), int(match.group(2))
+            pending[name] = cumulative
+            if len(match.group(3)) == 1:
+                if name == module:
+                    timings = pending
+                pending = {}
+        total = timings.get(module, 0)
+        if best is None or total < best[0]:
+            best = (total, timings)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="Modules under src/ to import")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per module, fastest is kept")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest top-level dependencies to list")
+    parser.add_argument("--max-ms", type=float, help="Fail when a module takes longer than this to import")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        total, timings = measure(module, args.runs)
+        print(f"{module}: {total / 1000:.1f} ms")
+        top_level = {}
+        for name, cumulative in timings.items():
+            root = name.split(".")[0]
+            if root != module:
+                top_level[root] = max(top_level.get(root, 0), cumulative)
+        for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+        loaded = sorted(name for name in HEAVY_MODULES if name in top_level)
+        if loaded:
+            failures.append(f"{module} imports {', '.join(loaded)} at load time")
+        if args.max_ms is not None and total / 1000 > args.max_ms:
+            failures.append(f"{module} takes {total / 1000:.1f} ms to import (limit {args.max_ms} ms)")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ No heavy SDK imported at load time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compact paper and score records
+
+Listings in the in-process cache and entries of the score cache add up to many
+thousands of papers (hundreds of thousands over a long backfill), so they are
+kept as __slots__ records rather than dicts: subject strings are interned and
+shared between papers, the abstract and PDF links are derived from the arXiv
+number, and the model's answer lives in a separate Score record.
+
+The scoring and rendering code keeps working on plain dicts; Paper.to_dict()
+and Score.to_item() are the conversions at those boundaries, and the JSONL
+files keep their format.
+"""
+import dataclasses
+import sys
+
+from categories import subjects_to_mask
+
+ABS_URL = "https://arxiv.org/abs/"
+PDF_URL = "https://arxiv.org/pdf/"
+
+
+@dataclasses.dataclass(slots=True)
+class Paper:
+    """One listing entry; number is the bare arXiv id (e.g. 2405.00001)"""
+    number: str
+    title: str
+    authors: str
+    subjects: str
+    abstract: str
+    subject_mask: int = 0
+
+    def __post_init__(self):
+        # 同一列表中大量论文的学科组合相同，驻留后只保留一份字符串
+        self.subjects = sys.intern(self.subjects)
+
+    @property
+    def main_page(self):
+        return self.number if "://" in self.number else ABS_URL + self.number
+
+    @property
+    def pdf(self):
+        return self.main_page.replace("/abs/", "/pdf/", 1) if "://" in self.number else PDF_URL + self.number
+
+    @classmethod
+    def from_record(cls, record):
+        """From a parsed listing entry (number, title, authors, subjects, abstract)"""
+        return cls(*record, subject_mask=subjects_to_mask(record[3]))
+
+    @classmethod
+    def from_dict(cls, paper):
+        """
+        From a listing file line. The stored subject_mask is not trusted: its bits
+        depend on the taxonomy at the time it was written, so it is recomputed
+        """
+        main_page = paper["main_page"]
+        number = main_page[len(ABS_URL):] if main_page.startswith(ABS_URL) else main_page
+        subjects = paper.get("subjects", "")
+        return cls(number, paper.get("title", ""), paper.get("authors", ""), subjects,
+                   paper.get("abstract", ""), subjects_to_mask(subjects))
+
+    def to_dict(self):
+        """Paper dict as used by scoring, rendering and the listing files"""
+        return {
+            'main_page': self.main_page,
+            'pdf': self.pdf,
+            'title': self.title,
+            'authors': self.authors,
+            'subjects': self.subjects,
+            'abstract': self.abstract,
+            'subject_mask': self.subject_mask,
+        }
+
+
+@dataclasses.dataclass(slots=True)
+class Score:
+    """The model's answer for one paper; keys other than the known ones are kept in extra"""
+    score: object = None
+    reasons: str = None
+    reasons_zh: str = None
+    summary: str = None
+    summary_zh: str = None
+    extra: dict = None
+
+    # 响应中的键 -> 字段
+    KEYS = {
+        "Relevancy score": "score",
+        "Reasons for match": "reasons",
+        "中文原因": "reasons_zh",
+        "Detailed Summary": "summary",
+        "详细总结": "summary_zh",
+    }
+
+    @classmethod
+    def from_item(cls, item):
+        score, extra = cls(), None
+        for key, value in item.items():
+            field = cls.KEYS.get(key)
+            if field is not None:
+                setattr(score, field, value)
+            else:
+                extra = extra or {}
+                extra[key] = value
+        score.extra = extra
+        return score
+
+    def to_item(self):
+        """Response item dict, the form merged into paper dicts"""
+        item = {key: getattr(self, field) for key, field in self.KEYS.items() if getattr(self, field) is not None}
+        if self.extra:
+            item.update(self.extra)
+        return item
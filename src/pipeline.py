@@ -0,0 +1,378 @@
+"""
+Streaming digest pipeline
+
+Runs the daily digest as concurrent stages connected by bounded asyncio queues:
+
+    fetch listings --papers--> batch + score --scored papers--> render entries
+
+Every topic listing is downloaded and parsed in a worker thread, and its papers
+are queued as soon as that listing is ready, so scoring starts while the other
+listings are still downloading. Each scored batch is rendered while the next
+batches are still with the model. A full queue blocks its producer, and scoring
+stops reading papers while all workers are busy, so memory stays bounded. When a
+stage fails the other stages are cancelled. Only the final ordering and the size
+budget wait for the last batch. With max_papers, only the running top-k papers
+and their entries are kept. With two_stage, the batches only run the score-only
+pass; the summaries are generated once, for the overall top-k winners. Papers
+left unscored by the LLM budget are ranked by keyword once, after the last
+batch, and listed after the model-scored papers.
+
+Produces the same digest as action.generate_body_enhanced. Only when the budget
+runs out mid-run can the two differ in which papers were scored before it did,
+since batches finish in any order.
+
+generate_bodies_pipelined runs several configs in one process: the listings of
+all their topics are downloaded once, and the configs are scored concurrently
+with one limit on the scoring requests in flight, shared score caches, one LLM
+budget and one batch size controller per model.
+"""
+import asyncio
+import contextlib
+import functools
+import time
+
+from action import build_custom_api_config, calibration_settings, get_topic_papers, resolve_topics, topic_abbr
+from batch_control import BatchSizeController
+from budget import BUDGET_SCOPE
+from download_new_papers import get_listing, paper_id
+from relevancy import (TopKPapers, generate_relevance_score, item_score, keyword_rank, score_only_pass,
+                       summarize_winners)
+from render import Digest, EntryRenderer, render_message, test_mode_notice
+from score_cache import ScoreCache
+
+# 队列结束标记
+_DONE = object()
+
+
+async def fetch_stage(topics_to_search, categories, out, test_mode=False, date=None, watermark=None):
+    """
+    Download all listings concurrently and queue their papers listing by listing, in completion order
+    (in topic order in test mode)
+
+    Returns:
+        tuple: (number of papers fetched, number of papers queued)
+    """
+    limit = 1 if test_mode else None
+    tasks = [asyncio.ensure_future(asyncio.to_thread(get_topic_papers, topic, categories, limit, date))
+             for topic in topics_to_search]
+    fetched = queued = 0
+    try:
+        # 测试模式按 topics 的顺序取第一个有论文的列表，结果不依赖哪个列表先下载完
+        for next_listing in (tasks if test_mode else asyncio.as_completed(tasks)):
+            papers = await next_listing
+            fetched += len(papers)
+            if watermark is not None:
+                papers = watermark.unseen(papers)
+            for paper in papers:
+                await out.put(paper)
+            queued += len(papers)
+            # In test mode, stop after the first listing with a paper
+            if test_mode and queued:
+                print(f"🧪 Test mode: Limited to {queued} paper(s)")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    if watermark is not None:
+        watermark.new_papers = queued
+    await out.put(_DONE)
+    return fetched, queued
+
+
+async def score_stage(inp, out, batch_size, workers, score_batch, slots=None, batch_control=None):
+    """
+    Group queued papers into batches and score up to `workers` batches at a time;
+    selected papers are queued as (input position, paper) as each batch completes,
+    so later stages can break ties in input order like the sequential run.
+    score_batch(papers) -> (selected papers, hallucination) runs in a worker thread;
+    the selected papers must be papers of the batch (matched by arXiv id)
+    slots: optional asyncio.Semaphore shared with other pipelines, replacing `workers`
+    batch_control: optional BatchSizeController whose current size replaces batch_size
+
+    Returns:
+        tuple: (papers read from the queue, hallucination)
+    """
+    processed, batch, tasks = [], [], []
+    slots = slots or asyncio.Semaphore(workers)
+
+    def slot_releaser():
+        # 每个批次的名额只释放一次；任务在开始执行前被取消时由完成回调释放，避免共享的 slots 泄漏
+        released = False
+
+        def release(*_):
+            nonlocal released
+            if not released:
+                released = True
+                slots.release()
+        return release
+
+    async def score(papers, start, release):
+        try:
+            relevancy, hallucination = await asyncio.to_thread(score_batch, papers)
+        finally:
+            release()
+        positions = {}
+        for idx, paper in enumerate(papers):
+            positions.setdefault(paper_id(paper), start + idx)
+        for paper in relevancy:
+            await out.put((positions[paper_id(paper)], paper))
+        return hallucination
+
+    try:
+        while True:
+            paper = await inp.get()
+            if paper is not _DONE:
+                processed.append(paper)
+                batch.append(paper)
+            size = batch_control.size if batch_control is not None else batch_size
+            if batch and (len(batch) >= size or paper is _DONE):
+                # 所有 worker 都忙时不再读取新论文，上游队列满后抓取阶段随之等待
+                await slots.acquire()
+                release = slot_releaser()
+                task = asyncio.ensure_future(score(batch, len(processed) - len(batch), release))
+                task.add_done_callback(release)
+                tasks.append(task)
+                # 已失败的批次立即终止流水线，而不是读完全部论文后才报错
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        task.result()
+                batch = []
+            if paper is _DONE:
+                break
+        hallucination = any(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    await out.put(_DONE)
+    return processed, hallucination
+
+
+async def render_stage(inp, renderer, ordered=False):
+    """Render each paper's entry as it arrives; ordered: the queue holds (position, paper) pairs"""
+    while True:
+        paper = await inp.get()
+        if paper is _DONE:
+            return
+        if ordered:
+            renderer.add(paper[1], order=paper[0])
+        else:
+            renderer.add(paper)
+
+
+async def collect_stage(inp, selection):
+    """Gather the (position, paper) first-pass winners of two-stage scoring into a relevancy.TopKPapers"""
+    while True:
+        paper = await inp.get()
+        if paper is _DONE:
+            return
+        selection.push(paper[1], order=paper[0])
+
+
+def _in_input_order(papers, processed):
+    """Papers collected from concurrently finishing batches, back in the order they were read"""
+    positions = {}
+    for idx, paper in enumerate(processed):
+        positions.setdefault(paper_id(paper), idx)
+    return sorted(papers, key=lambda paper: positions[paper_id(paper)])
+
+
+async def _run_stages(*stages):
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # 任一阶段失败或整个流水线被取消时，停止其余阶段
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def generate_body_pipelined(config, test_mode=False, watermark=None, cumulative=False, score_cache=None,
+                                  budget=None, batch_control=None, queue_size=64, workers=None, slots=None):
+    """
+    Pipelined equivalent of action.generate_body_enhanced
+    Returns a render.Digest with the HTML body and its plain-text alternative
+    queue_size: capacity of the queues between stages
+    workers: concurrent scoring requests (default config["pipeline_workers"] or 4)
+    slots: optional asyncio.Semaphore limiting the scoring requests of several pipelines together
+    """
+    started = time.perf_counter()
+    topics_to_search = resolve_topics(config)
+    categories = config["categories"] if config["categories"] else []
+    interest = config["interest"]
+    workers = workers or config.get("pipeline_workers", 4)
+
+    papers_q = asyncio.Queue(maxsize=queue_size)
+    fetch = fetch_stage(topics_to_search, categories, papers_q, test_mode=test_mode, watermark=watermark)
+
+    if interest:
+        custom_api_config, model_name = build_custom_api_config(config)
+        if score_cache is None and config.get("score_cache"):
+            score_cache = ScoreCache(config["score_cache"])
+        two_stage = config.get("two_stage", False)
+        # In test mode, reduce num_paper_in_prompt to 1
+        num_papers_in_prompt = 1 if test_mode else 8
+        threshold = config["threshold"]
+        top_k = config.get("max_papers")
+        query = {"interest": interest}
+        calibration = calibration_settings(config)
+        scored_q = asyncio.Queue(maxsize=queue_size)
+
+        if two_stage:
+            # 第一阶段按批只给出分数；总结只在全部批次结束后为全局前 top_k 篇生成一次
+            batch_size = config.get("score_batch_size", 32)
+            unscored = []
+
+            def first_pass(papers):
+                scored, hallucination, remaining = score_only_pass(
+                    papers, query, model_name, batch_size, custom_api_config=custom_api_config,
+                    score_cache=score_cache, budget=budget, threshold_score=threshold, **calibration
+                )
+                unscored.extend(remaining)
+                winners = []
+                for score, paper in scored:
+                    if score >= threshold:
+                        paper["Relevancy score"] = score
+                        winners.append(paper)
+                return winners, hallucination
+
+            winners = TopKPapers(top_k or None)
+            (fetched, _), (processed, hallucination), _ = await _run_stages(
+                fetch,
+                score_stage(papers_q, scored_q, batch_size, workers, first_pass, slots),
+                collect_stage(scored_q, winners),
+            )
+            winners = winners.sorted()
+            print(f"Score-only pass selected {len(winners)}/{len(processed)} papers for summaries")
+            async with slots or contextlib.nullcontext():
+                relevancy, hallu = await asyncio.to_thread(
+                    summarize_winners, [(item_score(paper), paper) for paper in winners], query, model_name,
+                    num_papers_in_prompt, custom_api_config=custom_api_config, score_cache=score_cache,
+                    budget=budget, batch_control=batch_control
+                )
+            hallucination = hallucination or hallu
+            if unscored and budget is not None and budget.on_exhausted == "keywords":
+                relevancy += keyword_rank(_in_input_order(unscored, processed),
+                                          interest)[:top_k - len(relevancy) if top_k else None]
+            renderer = EntryRenderer(scored=True)
+            for paper in relevancy:
+                renderer.add(paper)
+        else:
+            # 预算用尽后各批次未评分的论文，全部批次结束后统一按关键词排序
+            unscored = []
+            score_batch = functools.partial(
+                generate_relevance_score,
+                query=query,
+                threshold_score=threshold,
+                num_paper_in_prompt=num_papers_in_prompt,
+                model_name=model_name,
+                custom_api_config=custom_api_config,
+                score_cache=score_cache,
+                top_k=top_k,
+                budget=budget,
+                batch_control=batch_control,
+                sorting=False,
+                unscored=unscored,
+                **calibration,
+            )
+            # 每批只保留批内前 top_k 篇，渲染阶段再维护全局前 top_k 篇，内存不随入选论文数增长
+            renderer = EntryRenderer(scored=True, top_k=top_k)
+            (fetched, _), (processed, hallucination), _ = await _run_stages(
+                fetch,
+                score_stage(papers_q, scored_q, num_papers_in_prompt, workers, score_batch, slots, batch_control),
+                render_stage(scored_q, renderer, ordered=True),
+            )
+            relevancy = renderer.papers
+            if unscored and budget.on_exhausted == "keywords":
+                relevancy += keyword_rank(_in_input_order(unscored, processed),
+                                          interest)[:top_k - len(relevancy) if top_k else None]
+    else:
+        renderer = EntryRenderer(scored=False)
+        (fetched, _), _ = await _run_stages(fetch, render_stage(papers_q, renderer))
+        processed = relevancy = renderer.papers
+        hallucination = False
+    print(f"⏱️ Pipeline finished in {time.perf_counter() - started:.1f}s "
+          f"({fetched} papers fetched, {len(processed)} processed, {len(relevancy)} selected)")
+
+    if not fetched:
+        return render_message("No papers found matching the specified criteria.")
+    if watermark is not None:
+        if not processed and not cumulative:
+            return render_message("No new papers since the last run.")
+        watermark.record(processed, relevancy)
+        if cumulative:
+            relevancy = sorted(watermark.previous_relevant() + relevancy, key=item_score, reverse=True)
+
+    # Optional size budget: lower-ranked papers are folded to stay below max_digest_kb
+    max_bytes = config["max_digest_kb"] * 1024 if config.get("max_digest_kb") else None
+    body = renderer.render(relevancy, hallucination, max_bytes=max_bytes,
+                           archive_url=config.get("digest_archive_url"))
+    test_notice = test_mode_notice(len(processed)) if test_mode else Digest()
+    return test_notice + body
+
+
+async def prefetch_listings(configs, date=None):
+    """
+    Download the listing of every field used by the configs once, concurrently.
+    Errors are left to the run of the config concerned, which fetches its listings again
+    """
+    fields = set()
+    for config in configs:
+        try:
+            fields.update(topic_abbr(topic) for topic in resolve_topics(config))
+        except RuntimeError:
+            continue
+    fields = sorted(fields)
+    print(f"Fetching {len(fields)} listings for {len(configs)} configs: {', '.join(fields)}")
+    await asyncio.gather(*(asyncio.to_thread(get_listing, field, date) for field in fields), return_exceptions=True)
+
+
+async def _in_budget_scope(scope, run):
+    # 每个配置在自己的任务中运行，设置的范围只作用于该任务及其工作线程
+    BUDGET_SCOPE.set(scope)
+    return await run
+
+
+async def generate_bodies_pipelined(configs, test_mode=False, watermarks=None, cumulative=False, budget=None,
+                                    adaptive_batch=True, workers=None):
+    """
+    Run generate_body_pipelined for several configs in one event loop
+
+    The union of their listings is fetched first, so every config reads the same
+    in-process listing; scoring requests of all configs share `workers` slots
+    (default: the largest pipeline_workers, or 4). Configs naming the same
+    score_cache file share one ScoreCache, and configs using the same model share
+    one BatchSizeController. A failing config does not stop the others. The
+    budget spend of config i is attributed to budget.BUDGET_SCOPE i, so the
+    caller can report what a failed config spent.
+
+    Returns:
+        tuple: (list of render.Digest or the exception of each config, dict of model name -> BatchSizeController)
+    """
+    started = time.perf_counter()
+    watermarks = watermarks or [None] * len(configs)
+    workers = workers or max(config.get("pipeline_workers", 4) for config in configs)
+    slots = asyncio.Semaphore(workers)
+    await prefetch_listings(configs)
+
+    score_caches, batch_controls, runs = {}, {}, []
+    for config, watermark in zip(configs, watermarks):
+        path = config.get("score_cache")
+        if path and path not in score_caches:
+            score_caches[path] = ScoreCache(path)
+        score_cache = score_caches.get(path) if path else None
+        batch_control = None
+        if adaptive_batch and config.get("interest"):
+            model_name = build_custom_api_config(config)[1]
+            if model_name not in batch_controls:
+                batch_controls[model_name] = BatchSizeController.from_config(config, model_name)
+            batch_control = batch_controls[model_name]
+        runs.append(_in_budget_scope(len(runs), generate_body_pipelined(
+            config, test_mode=test_mode, watermark=watermark, cumulative=cumulative, score_cache=score_cache,
+            budget=budget, batch_control=batch_control, slots=slots
+        )))
+    bodies = await asyncio.gather(*runs, return_exceptions=True)
+    print(f"⏱️ {len(configs)} configs finished in {time.perf_counter() - started:.1f}s")
+    return bodies, {name: control for name, control in batch_controls.items() if control is not None}
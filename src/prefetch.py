@@ -0,0 +1,122 @@
+"""
+Background prefetch for the web app
+
+A daemon thread downloads and parses every topic listing once a day, shortly
+after the listing date rolls over in New York (arXiv announces the new
+submissions at 20:00 ET the evening before), and precomputes the subject
+indexes of each listing. Requests of the day then hit the in-process listing
+cache instead of paying the download inside the request.
+
+Optionally the sample papers are also pre-scored for the interests users
+entered recently, so a repeated query is served from the score cache.
+"""
+import collections
+import datetime
+import threading
+import time
+
+import pytz
+
+from categories import topics, physics_topics, category_map, SUBJECT_IDS
+from download_new_papers import get_listing, get_papers
+from relevancy import generate_relevance_score
+
+_EASTERN = pytz.timezone("America/New_York")
+
+
+def listing_abbrs():
+    """(topic name, listing abbreviation) of every topic the app offers"""
+    pairs = [(name, abbr) for name, abbr in topics.items() if name != "Physics"]
+    pairs.extend(physics_topics.items())
+    return pairs
+
+
+def seconds_until(hour, minute, now=None):
+    """Seconds until the next hour:minute in New York time."""
+    now = (now or datetime.datetime.now(tz=_EASTERN)).astimezone(_EASTERN)
+    # 按目标当天的 UTC 偏移解释墙钟时间；now.replace() 会沿用 now 的偏移，跨夏令时切换时差一小时
+    wall_time = datetime.time(hour, minute)
+    target = _EASTERN.localize(datetime.datetime.combine(now.date(), wall_time))
+    if target <= now:
+        target = _EASTERN.localize(datetime.datetime.combine(now.date() + datetime.timedelta(days=1), wall_time))
+    return (target - now).total_seconds()
+
+
+class Prefetcher(threading.Thread):
+    """
+    Daemon that warms the listing cache at start-up and every day at
+    hour:minute New York time
+
+    prescore: also score the sample papers for the last `max_interests` interests
+    score_cache: ScoreCache shared with the request handlers
+    """
+
+    def __init__(self, hour=0, minute=5, pause=3.0, prescore=False, score_cache=None, max_interests=5,
+                 sample_size=4):
+        super().__init__(name="listing-prefetch", daemon=True)
+        self.hour = hour
+        self.minute = minute
+        self.pause = pause
+        self.prescore = prescore
+        self.score_cache = score_cache
+        self.sample_size = sample_size
+        self.max_interests = max_interests
+        self._interests = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def note_interest(self, abbr, categories, interest):
+        """Remember a query so the next prefetch can pre-score it"""
+        if not interest:
+            return
+        key = (abbr, tuple(sorted(categories or [])), interest)
+        with self._lock:
+            self._interests[key] = True
+            self._interests.move_to_end(key)
+            while len(self._interests) > self.max_interests:
+                self._interests.popitem(last=False)
+
+    def warm_listings(self):
+        started = time.perf_counter()
+        warmed = 0
+        for topic, abbr in listing_abbrs():
+            if self._stopping.is_set():
+                break
+            try:
+                listing = get_listing(abbr)
+            except Exception as e:
+                print(f"⚠️ 预取 {abbr} 失败: {e}")
+                continue
+            # 预先计算每个子类别的查询结果
+            for category in category_map.get(topic, []):
+                if category in SUBJECT_IDS:
+                    listing.indices([category])
+            warmed += 1
+            self._stopping.wait(self.pause)
+        print(f"🔥 预取 {warmed} 个列表，用时 {time.perf_counter() - started:.1f}s")
+
+    def prescore_interests(self):
+        with self._lock:
+            queries = list(self._interests)
+        for abbr, categories, interest in queries:
+            if self._stopping.is_set():
+                break
+            papers = get_papers(abbr, limit=self.sample_size, categories=list(categories))
+            try:
+                generate_relevance_score(papers, query={"interest": interest}, threshold_score=0,
+                                         num_paper_in_prompt=self.sample_size, score_cache=self.score_cache)
+            except Exception as e:
+                print(f"⚠️ 预评分失败: {e}")
+
+    def run_once(self):
+        self.warm_listings()
+        if self.prescore and self.score_cache is not None:
+            self.prescore_interests()
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.run_once()
+            self._stopping.wait(seconds_until(self.hour, self.minute))
+
+    def stop(self):
+        self._stopping.set()
@@ -1,45 +1,86 @@
 """
 Enhanced relevancy module for bilingual output and cross-domain paper analysis
 """
+import collections
+import functools
+import heapq
+import math
 import time
 import json
 import os
 import random
 import re
+import statistics
 import string
 from datetime import datetime
 
-import numpy as np
 import tqdm
 import utils
+from categories import process_subject_fields, filter_papers_by_subjects
+from score_cache import interest_key
+from budget import BudgetExhausted
 
 
-def encode_prompt(query, prompt_papers):
-    """Encode multiple prompt instructions into a single string."""
-    prompt = open("src/relevancy_prompt.txt").read() + "\n"
-    prompt += query['interest']
+PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevancy_prompt.txt")
+# 两阶段评分的第一阶段：只要分数，不要解释和总结
+SCORE_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevancy_score_prompt.txt")
+
+
+@functools.lru_cache(maxsize=None)
+def prompt_template(path=PROMPT_PATH):
+    """Scoring instructions, read once per process"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=64)
+def prompt_prefix(interest, path=PROMPT_PATH):
+    """
+    Instructions plus research interest. The string is identical for every batch
+    of a run, so the provider's prefix cache serves it after the first request.
+    """
+    return prompt_template(path) + "\n" + interest
+
 
+def encode_papers(prompt_papers):
+    """Encode the papers of one batch; this is the only part of the prompt that changes."""
+    parts = []
     for idx, task_dict in enumerate(prompt_papers):
         (title, authors, abstract) = task_dict["title"], task_dict["authors"], task_dict["abstract"]
         if not title:
             raise ValueError(f"Empty title for paper {idx}")
-        prompt += f"###\n"
-        prompt += f"{idx + 1}. Title: {title}\n"
-        prompt += f"{idx + 1}. Authors: {authors}\n"
-        prompt += f"{idx + 1}. Abstract: {abstract}\n"
-    prompt += f"\n Generate response:\n1."
+        parts.append(f"###\n")
+        parts.append(f"{idx + 1}. Title: {title}\n")
+        parts.append(f"{idx + 1}. Authors: {authors}\n")
+        parts.append(f"{idx + 1}. Abstract: {abstract}\n")
+    parts.append("\n Generate response:\n1.")
+    return "".join(parts)
+
+
+def encode_prompt(query, prompt_papers):
+    """Encode multiple prompt instructions into a single string."""
+    prompt = prompt_prefix(query['interest']) + encode_papers(prompt_papers)
     print("Generated prompt length:", len(prompt))
     return prompt
 
 
-def post_process_chat_gpt_response(paper_data, response, threshold_score=6):
+def encode_messages(query, prompt_papers, path=PROMPT_PATH):
     """
-    Enhanced post-processing for bilingual responses with multiple fields
+    Chat messages for one batch: the shared prefix as the leading system message,
+    the batch's papers as the user message
     """
-    selected_data = []
-    if response is None:
-        return [], True
+    messages = [
+        {"role": "system", "content": prompt_prefix(query['interest'], path)},
+        {"role": "user", "content": encode_papers(prompt_papers)},
+    ]
+    print("Generated prompt length:", sum(len(m["content"]) for m in messages))
+    return messages
+
 
+def parse_response_items(response):
+    """
+    Parse the per-paper JSON objects out of a chat completion response
+    """
     response_content = response['message']['content'].replace("\n\n", "\n")
 
     # 清理响应内容，移除markdown代码块标记
@@ -120,21 +161,28 @@ def post_process_chat_gpt_response(paper_data, response, threshold_score=6):
     print(f"Successfully parsed {len(score_items)} items from response")
     if score_items:
         pprint.pprint(score_items[:1])  # Show first item for debugging
+    return score_items
 
-    # Extract scores
-    scores = []
-    for item in score_items:
-        temp = item.get("Relevancy score", item.get("relevancy score", 0))
-        if isinstance(temp, str):
-            if "/" in temp:
-                scores.append(int(temp.split("/")[0]))
-            else:
-                try:
-                    scores.append(int(temp))
-                except ValueError:
-                    scores.append(0)
-        else:
-            scores.append(int(temp))
+
+def item_score(item):
+    """Integer relevancy score of a parsed response item."""
+    temp = item.get("Relevancy score", item.get("relevancy score", 0))
+    if isinstance(temp, str):
+        if "/" in temp:
+            return int(temp.split("/")[0])
+        try:
+            return int(temp)
+        except ValueError:
+            return 0
+    return int(temp)
+
+
+def select_scored_papers(paper_data, score_items, threshold_score=6):
+    """
+    Attach parsed response items to their papers and keep those above threshold
+    """
+    selected_data = []
+    scores = [item_score(item) for item in score_items]
 
     # Handle hallucination (more items returned than input papers)
     if len(score_items) > len(paper_data):
@@ -157,57 +205,95 @@ def post_process_chat_gpt_response(paper_data, response, threshold_score=6):
         if scores[idx] < threshold_score:
             continue
 
-        # Build output string for display
-        output_str = "Title: " + paper_data[idx]["title"] + "\n"
-        output_str += "Authors: " + paper_data[idx]["authors"] + "\n"
-        output_str += "Link: " + paper_data[idx]["main_page"] + "\n"
-
         # Add all fields from the response to the paper data
-        for key, value in inst.items():
-            paper_data[idx][key] = value
-            output_str += str(key) + ": " + str(value) + "\n"
-
-        paper_data[idx]['summarized_text'] = output_str
+        paper_data[idx].update(inst)
         selected_data.append(paper_data[idx])
 
     return selected_data, hallucination
 
 
-def find_word_in_string(w, s):
-    return re.compile(r"\b({0})\b".format(w), flags=re.IGNORECASE).search(s)
+# 论文本身的字段和复评记录，其余字段来自模型的回答
+_PAPER_KEYS = frozenset(("main_page", "pdf", "title", "authors", "subjects", "abstract", "subject_mask",
+                         "Score samples"))
 
 
-def process_subject_fields(subjects):
+def summarized_text(paper):
     """
-    增强版的subjects字段处理函数
-    修复了处理"Subjects:"前缀和换行符的问题
+    Plain-text summary of a selected paper: title, authors, link and the model's answer
+    (built on demand instead of being stored on every paper)
     """
-    if not subjects:
-        return []
+    output_str = "Title: " + paper["title"] + "\n"
+    output_str += "Authors: " + paper["authors"] + "\n"
+    output_str += "Link: " + paper["main_page"] + "\n"
+    for key, value in paper.items():
+        if key not in _PAPER_KEYS:
+            output_str += str(key) + ": " + str(value) + "\n"
+    return output_str
+
+
+def post_process_chat_gpt_response(paper_data, response, threshold_score=6):
+    """
+    Enhanced post-processing for bilingual responses with multiple fields
+    """
+    if response is None:
+        return [], True
+    score_items = parse_response_items(response)
+    return select_scored_papers(paper_data, score_items, threshold_score)
 
-    # 处理换行符和多余空格
-    subjects = subjects.replace('\n', ' ').strip()
 
-    # 去掉可能的"Subjects:"前缀
-    if subjects.startswith('Subjects:'):
-        subjects = subjects[9:].strip()
+@functools.lru_cache(maxsize=1024)
+def _word_pattern(w):
+    return re.compile(r"\b({0})\b".format(w), flags=re.IGNORECASE)
 
-    # 按分号分割
-    all_subjects = subjects.split(";")
 
-    # 清理每个subject
-    cleaned_subjects = []
-    for s in all_subjects:
-        # 去掉前后空格
-        s = s.strip()
-        # 去掉括号及其内容
-        if " (" in s:
-            s = s.split(" (")[0].strip()
-        # 只添加非空的subject
-        if s:
-            cleaned_subjects.append(s)
+def find_word_in_string(w, s):
+    return _word_pattern(w).search(s)
+
+
+# 从兴趣描述中提取关键词时忽略的常见词
+_STOPWORDS = frozenset("""
+about above after again also analysis based being between both could design designs does doing during each
+especially focus from have having include includes including interested interest into methods more most other
+paper papers please provide related research some such than that their them then there these they this those
+through topics under using very want well what when where which while will with within would your
+""".split())
 
-    return cleaned_subjects
+
+def interest_keywords(interest, max_keywords=40):
+    """
+    English keywords of an interest description, in order of appearance
+    """
+    keywords = []
+    for word in re.findall(r"[A-Za-z][A-Za-z0-9-]{3,}", interest):
+        word = word.lower()
+        if word not in _STOPWORDS and word not in keywords:
+            keywords.append(word)
+    return keywords[:max_keywords]
+
+
+def keyword_rank(papers, interest, keywords=None):
+    """
+    Local prefilter ranking without the LLM: papers matching any interest keyword,
+    best first, with a 1-10 score relative to the best match (title hits count twice)
+    """
+    keywords = keywords or interest_keywords(interest)
+    scored = []
+    for paper in papers:
+        title, abstract = paper.get("title", ""), paper.get("abstract", "")
+        hits = [w for w in keywords if find_word_in_string(re.escape(w), title + " " + abstract)]
+        points = sum(2 if find_word_in_string(re.escape(w), title) else 1 for w in hits)
+        if points:
+            scored.append((points, hits, paper))
+    if not scored:
+        return []
+    best = max(points for points, _, _ in scored)
+    ranked = []
+    for points, hits, paper in sorted(scored, key=lambda x: x[0], reverse=True):
+        paper = dict(paper)
+        paper["Relevancy score"] = max(1, round(10 * points / best))
+        paper["Reasons for match"] = "Keyword match (not scored by the model): " + ", ".join(hits)
+        ranked.append(paper)
+    return ranked
 
 
 def generate_relevance_score(
@@ -219,43 +305,117 @@ def generate_relevance_score(
     temperature=0.4,
     top_p=1.0,
     sorting=True,
-    custom_api_config=None
+    custom_api_config=None,
+    score_cache=None,
+    top_k=None,
+    budget=None,
+    two_stage=False,
+    score_batch_size=32,
+    batch_control=None,
+    calibration_samples=0,
+    calibration_margin=1,
+    unscored=None
 ):
     """
     Enhanced relevance scoring with bilingual support and custom API
+    score_cache: optional ScoreCache; papers already scored for this model and
+    interest are answered from it and only the rest are sent to the model
+    top_k: optional cap on the number of returned papers; selection is streamed
+    through a min-heap so papers below the running cutoff are dropped early
+    budget: optional budget.TokenBudget; once the next request would exceed it the
+    remaining papers are ranked by keyword match (or dropped) instead of scored
+    two_stage: first ask only for scores (score_batch_size papers per request),
+    then generate the bilingual reasons and summaries only for the selected papers
+    batch_control: optional batch_control.BatchSizeController choosing the number of
+    papers per request instead of num_paper_in_prompt
+    calibration_samples: re-score papers within calibration_margin of threshold_score
+    this many more times and use the median score (see calibrate_scores)
+    unscored: optional list; papers left unscored by the budget are appended to it
+    instead of being ranked by keyword here, for callers that score in batches
     """
-    ans_data = []
+    if two_stage:
+        return two_stage_relevance_score(
+            all_papers, query, model_name, threshold_score, num_paper_in_prompt, temperature, top_p,
+            custom_api_config, score_cache, top_k, budget, score_batch_size, batch_control,
+            calibration_samples, calibration_margin
+        )
+
+    fallback = []
+    # 分数在阈值附近、等待复评的 (论文, 回答)
+    borderline = []
+
+    def is_borderline(item):
+        return needs_calibration(item, threshold_score, calibration_samples, calibration_margin)
+
+    ans_data = TopKPapers(top_k) if top_k else []
     request_idx = 1
     hallucination = False
 
-    print(f"Processing {len(all_papers)} papers in batches of {num_paper_in_prompt}")
+    if score_cache is not None:
+        cache_key = score_cache_key(model_name, query, custom_api_config)
+        pending_papers = []
+        for paper in all_papers:
+            item = score_cache.get(cache_key, paper)
+            if item is None:
+                pending_papers.append(paper)
+            elif is_borderline(item):
+                borderline.append((paper, item))
+            else:
+                batch_threshold = ans_data.cutoff(threshold_score) if top_k else threshold_score
+                ans_data.extend(select_scored_papers([paper], [item], batch_threshold)[0])
+        print(f"Score cache hits: {len(all_papers) - len(pending_papers)}/{len(all_papers)}")
+        all_papers = pending_papers
+
+    if batch_control is not None:
+        print(f"Processing {len(all_papers)} papers in adaptive batches (currently {batch_control.size})")
+    else:
+        print(f"Processing {len(all_papers)} papers in batches of {num_paper_in_prompt}")
     if custom_api_config and custom_api_config.use_custom_api:
         print(f"Using custom API: {custom_api_config.api_url}")
         print(f"Model: {custom_api_config.model_name}")
 
-    for id in tqdm.tqdm(range(0, len(all_papers), num_paper_in_prompt)):
-        prompt_papers = all_papers[id:id+num_paper_in_prompt]
-        prompt = encode_prompt(query, prompt_papers)
+    progress = tqdm.tqdm(total=len(all_papers), unit="paper")
+    id = 0
+    while id < len(all_papers):
+        batch_size = batch_control.size if batch_control is not None else num_paper_in_prompt
+        prompt_papers = all_papers[id:id+batch_size]
+        messages = encode_messages(query, prompt_papers)
+        prompt = utils.prompt_text(messages)
 
         # Increased max_tokens for bilingual responses
         decoding_args = utils.OpenAIDecodingArguments(
             temperature=temperature,
             n=1,
-            max_tokens=256*num_paper_in_prompt,  # Increased for bilingual content
+            max_tokens=256*len(prompt_papers),  # Increased for bilingual content
             top_p=top_p,
         )
 
         request_start = time.time()
-        response = utils.openai_completion(
-            prompts=prompt,
-            model_name=model_name,
-            batch_size=1,
-            decoding_args=decoding_args,
-            logit_bias={"100257": -100},  # prevent the <|endoftext|> from being generated
-            custom_api_config=custom_api_config
-        )
+        try:
+            response = budgeted_completion(
+                budget,
+                prompt,
+                prompts=messages,
+                model_name=model_name,
+                batch_size=1,
+                decoding_args=decoding_args,
+                logit_bias={"100257": -100},  # prevent the <|endoftext|> from being generated
+                custom_api_config=custom_api_config
+            )
+        except BudgetExhausted:
+            remaining = all_papers[id:]
+            budget.skip(len(remaining))
+            print(f"⚠️ LLM budget exhausted, {len(remaining)} papers left unscored")
+            if unscored is not None:
+                unscored.extend(remaining)
+            elif budget.on_exhausted == "keywords":
+                fallback = keyword_rank(remaining, query["interest"])
+            break
 
         print(f"Response for batch {request_idx}:")
+        cached_tokens = getattr(response, "cached_tokens", None)
+        if cached_tokens:
+            print(f"Prompt cache hit: {cached_tokens}/{response.prompt_tokens} tokens")
         if hasattr(response, 'message') and 'content' in response.message:
             content = response.message['content']
             print(content[:500] + "..." if len(content) > 500 else content)
@@ -265,9 +425,27 @@ def generate_relevance_score(
         request_duration = time.time() - request_start
 
         process_start = time.time()
-        batch_data, hallu = post_process_chat_gpt_response(
-            prompt_papers, response, threshold_score=threshold_score
-        )
+        if response is None:
+            batch_data, hallu = [], True
+        else:
+            score_items = parse_response_items(response)
+            # 只缓存与输入一一对应的结果，避免把错位的幻觉结果写入缓存
+            if score_cache is not None and len(score_items) == len(prompt_papers):
+                score_cache.put_many(cache_key, prompt_papers, score_items)
+            # top-k 已满时，不超过当前截止分数的论文无需再组装
+            batch_threshold = ans_data.cutoff(threshold_score) if top_k else threshold_score
+            if calibration_samples and len(score_items) == len(prompt_papers):
+                pairs = list(zip(prompt_papers, score_items))
+                borderline.extend((paper, item) for paper, item in pairs if is_borderline(item))
+                certain = [(paper, item) for paper, item in pairs if not is_borderline(item)]
+                batch_data, hallu = select_scored_papers([paper for paper, _ in certain],
+                                                         [item for _, item in certain], batch_threshold)
+            else:
+                batch_data, hallu = select_scored_papers(prompt_papers, score_items, batch_threshold)
+            if batch_control is not None:
+                batch_control.observe(len(prompt_papers), len(score_items),
+                                      truncated=getattr(response, "finish_reason", None) == "length",
+                                      latency=request_duration)
         hallucination = hallucination or hallu
         ans_data.extend(batch_data)
 
@@ -276,14 +454,429 @@ def generate_relevance_score(
         print(f"Found {len(batch_data)} relevant papers in this batch")
 
         request_idx += 1
-
-    if sorting and ans_data:
-        ans_data = sorted(ans_data, key=lambda x: int(x.get("Relevancy score", 0)), reverse=True)
+        id += len(prompt_papers)
+        progress.update(len(prompt_papers))
+    progress.close()
+
+    if borderline:
+        calibrated = calibrate_scores(borderline, query, model_name, calibration_samples, temperature, top_p,
+                                      score_batch_size, custom_api_config, budget)
+        if score_cache is not None and calibrated:
+            score_cache.put_many(cache_key, [paper for paper, _ in calibrated], [item for _, item in calibrated])
+        batch_threshold = ans_data.cutoff(threshold_score) if top_k else threshold_score
+        ans_data.extend(select_scored_papers([paper for paper, _ in borderline], [item for _, item in borderline],
+                                             batch_threshold)[0])
+
+    if top_k:
+        ans_data = ans_data.sorted()
+    elif sorting and ans_data:
+        ans_data = sorted(ans_data, key=item_score, reverse=True)
+    # 关键词排序的论文排在模型评分的论文之后
+    if fallback:
+        ans_data = list(ans_data) + fallback[:top_k - len(ans_data) if top_k else None]
 
     print(f"Total relevant papers found: {len(ans_data)}")
     return ans_data, hallucination
 
 
+def iter_stream_items(chunks):
+    """
+    Parse per-paper JSON objects out of streamed completion text, yielding each
+    one as soon as it is complete
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            start = buffer.find("{")
+            if start < 0:
+                buffer = ""
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, start)
+            except json.JSONDecodeError:
+                # 对象尚未写完，等待下一段
+                buffer = buffer[start:]
+                break
+            buffer = buffer[end:]
+            if isinstance(item, dict):
+                yield item
+
+
+def stream_relevance_score(papers, query, model_name="gpt-3.5-turbo-16k", temperature=0.4, top_p=1.0,
+                           custom_api_config=None, score_cache=None):
+    """
+    Score a small batch of papers in one streamed request, yielding each paper
+    with its answer merged in as soon as the model has finished it. Cached papers
+    come first. The stream is closed once every paper has an answer, and closing
+    this generator early aborts the request.
+    Fewer answers than papers means the model skipped or merged some, like the
+    hallucination check of generate_relevance_score.
+    """
+    pending = papers
+    if score_cache is not None:
+        cache_key = score_cache_key(model_name, query, custom_api_config)
+        pending = []
+        for paper in papers:
+            item = score_cache.get(cache_key, paper)
+            if item is None:
+                pending.append(paper)
+            else:
+                yield dict(paper, **item)
+    if not pending:
+        return
+
+    messages = encode_messages(query, pending)
+    decoding_args = utils.OpenAIDecodingArguments(
+        temperature=temperature,
+        n=1,
+        max_tokens=256 * len(pending),
+        top_p=top_p,
+    )
+    chunks = utils.stream_completion(messages, decoding_args, model_name, custom_api_config,
+                                     logit_bias={"100257": -100})
+    items = []
+    try:
+        for item in iter_stream_items(chunks):
+            items.append(item)
+            yield dict(pending[len(items) - 1], **item)
+            if len(items) == len(pending):
+                break
+    finally:
+        chunks.close()
+    if len(items) < len(pending):
+        print(f"Warning: Model returned {len(items)} items but {len(pending)} papers provided")
+    elif score_cache is not None:
+        score_cache.put_many(cache_key, pending, items)
+
+
+def budgeted_completion(budget, prompt, **completion_kwargs):
+    """
+    utils.openai_completion for one prompt, with its worst case reserved in the
+    budget first and replaced by the reported usage afterwards (released when
+    the request fails)
+
+    prompt: text form of the prompt, used to estimate its tokens
+    Raises BudgetExhausted when the request does not fit the remaining budget
+    """
+    if budget is None:
+        return utils.openai_completion(**completion_kwargs)
+    decoding_args = completion_kwargs["decoding_args"]
+    model_name = completion_kwargs["model_name"]
+    # n 个 choice 最多各用满 max_tokens
+    reservation = budget.try_reserve(model_name, prompt, decoding_args.max_tokens * decoding_args.n)
+    if reservation is None:
+        raise BudgetExhausted()
+    try:
+        response = utils.openai_completion(**completion_kwargs)
+    except BaseException:
+        budget.release(reservation)
+        raise
+    # 一次请求的用量覆盖全部 n 个 choice
+    first = response[0] if isinstance(response, list) and response else response
+    if first is None or isinstance(first, list):
+        budget.release(reservation)
+    else:
+        budget.record(model_name, prompt, first, reservation)
+    return response
+
+
+def needs_calibration(item, threshold_score, samples, margin=1):
+    """Whether a response item is close enough to the threshold to be re-scored (and not re-scored yet)"""
+    return bool(samples) and abs(item_score(item) - threshold_score) <= margin and "Score samples" not in item
+
+
+def score_only_pass(all_papers, query, model_name, batch_size=32, temperature=0.4, top_p=1.0,
+                    custom_api_config=None, score_cache=None, budget=None, threshold_score=6,
+                    calibration_samples=0, calibration_margin=1):
+    """
+    First stage of two-stage scoring: integer scores only, many papers per request.
+    With calibration_samples, scores within calibration_margin of threshold_score
+    are re-sampled (see calibrate_scores).
+
+    Returns:
+        tuple: (list of (score, paper) in input order, hallucination, papers left unscored by the budget)
+    """
+    # (回答, 论文)，复评会原地更新回答中的分数
+    scored = []
+    borderline = []
+    hallucination = False
+    pending_papers = all_papers
+    remaining = []
+    if score_cache is not None:
+        full_key = score_cache_key(model_name, query, custom_api_config)
+        score_key = score_cache_key(model_name, query, custom_api_config, score_only=True)
+        pending_papers = []
+        for paper in all_papers:
+            # 完整评分的缓存结果同样带有分数，复评过的分数优先
+            items = [item for item in (score_cache.get(full_key, paper), score_cache.get(score_key, paper))
+                     if item is not None]
+            item = next((item for item in items if "Score samples" in item), items[0] if items else None)
+            if item is None:
+                pending_papers.append(paper)
+                continue
+            item = {key: item[key] for key in ("Relevancy score", "Score samples") if key in item}
+            scored.append((item, paper))
+            if needs_calibration(item, threshold_score, calibration_samples, calibration_margin):
+                borderline.append((paper, item))
+        print(f"Score cache hits (score-only pass): {len(all_papers) - len(pending_papers)}/{len(all_papers)}")
+
+    print(f"Score-only pass: {len(pending_papers)} papers in batches of {batch_size}")
+    # 分数条数与论文数不一致时无法确定对应关系：把该批对半拆开放回队首重试，
+    # 直到单篇论文仍对不上才放弃，保持输入顺序
+    batches = collections.deque(pending_papers[id:id + batch_size]
+                                for id in range(0, len(pending_papers), batch_size))
+    progress = tqdm.tqdm(total=len(pending_papers), unit="paper")
+    while batches:
+        prompt_papers = batches.popleft()
+        messages = encode_messages(query, prompt_papers, SCORE_PROMPT_PATH)
+        prompt = utils.prompt_text(messages)
+        decoding_args = utils.OpenAIDecodingArguments(
+            temperature=temperature,
+            n=1,
+            max_tokens=16 * len(prompt_papers) + 16,  # 每篇论文只需一行 {"Relevancy score": n}
+            top_p=top_p,
+        )
+
+        try:
+            response = budgeted_completion(
+                budget,
+                prompt,
+                prompts=messages,
+                model_name=model_name,
+                batch_size=1,
+                decoding_args=decoding_args,
+                logit_bias={"100257": -100},
+                custom_api_config=custom_api_config
+            )
+        except BudgetExhausted:
+            remaining = [paper for batch in (prompt_papers, *batches) for paper in batch]
+            budget.skip(len(remaining))
+            print(f"⚠️ LLM budget exhausted, {len(remaining)} papers left unscored")
+            break
+        if response is None:
+            hallucination = True
+            progress.update(len(prompt_papers))
+            continue
+
+        score_items = [{"Relevancy score": item_score(item)} for item in parse_response_items(response)]
+        if len(score_items) != len(prompt_papers):
+            # 拆分重试后对上的批次不算幻觉，只有最终仍未评分的论文才算
+            if len(prompt_papers) > 1:
+                half = len(prompt_papers) // 2
+                print(f"Warning: Model returned {len(score_items)} scores for {len(prompt_papers)} papers, "
+                      f"retrying as {half} + {len(prompt_papers) - half}")
+                batches.extendleft((prompt_papers[half:], prompt_papers[:half]))
+            else:
+                hallucination = True
+                print(f"Warning: Model returned {len(score_items)} scores for "
+                      f"\"{prompt_papers[0]['title']}\", left unscored")
+                progress.update(1)
+            continue
+
+        borderline.extend((paper, item) for item, paper in zip(score_items, prompt_papers)
+                          if needs_calibration(item, threshold_score, calibration_samples, calibration_margin))
+        if score_cache is not None:
+            score_cache.put_many(score_key, prompt_papers, score_items)
+        scored.extend(zip(score_items, prompt_papers))
+        progress.update(len(prompt_papers))
+    progress.close()
+
+    if borderline:
+        calibrated = calibrate_scores(borderline, query, model_name, calibration_samples, temperature, top_p,
+                                      batch_size, custom_api_config, budget)
+        if score_cache is not None and calibrated:
+            score_cache.put_many(score_key, [paper for paper, _ in calibrated], [item for _, item in calibrated])
+    return [(item_score(item), paper) for item, paper in scored], hallucination, remaining
+
+
+def calibrate_scores(pairs, query, model_name, samples=2, temperature=0.4, top_p=1.0, batch_size=32,
+                     custom_api_config=None, budget=None):
+    """
+    Re-score borderline papers `samples` more times with the score-only prompt and
+    replace each item's score by the median of those samples, which are kept in
+    item["Score samples"]. The first-pass score is not part of the median: it may
+    come from the full prompt, which scores on a different scale. The samples are
+    requested with n > 1 in one request per batch; providers that ignore n are
+    asked again. Items keep their score when the answers do not line up with the
+    papers or the budget runs out.
+
+    pairs: list of (paper, response item); the items are updated in place
+    Returns:
+        list: the (paper, item) pairs that were calibrated
+    """
+    calibrated = []
+    print(f"Calibrating {len(pairs)} borderline papers with {samples} more samples each")
+    for start in range(0, len(pairs), batch_size):
+        chunk = pairs[start:start + batch_size]
+        papers = [paper for paper, _ in chunk]
+        messages = encode_messages(query, papers, SCORE_PROMPT_PATH)
+        prompt = utils.prompt_text(messages)
+        runs = []
+        while len(runs) < samples:
+            n = samples - len(runs)
+            decoding_args = utils.OpenAIDecodingArguments(
+                temperature=temperature,
+                n=n,
+                max_tokens=16 * len(papers) + 16,
+                top_p=top_p,
+            )
+            try:
+                choices = budgeted_completion(
+                    budget,
+                    prompt,
+                    prompts=messages,
+                    model_name=model_name,
+                    batch_size=1,
+                    decoding_args=decoding_args,
+                    custom_api_config=custom_api_config
+                )
+            except BudgetExhausted:
+                print("⚠️ LLM budget exhausted, calibration stopped")
+                return calibrated
+            choices = [choice for choice in (choices if isinstance(choices, list) else [choices]) if choice is not None]
+            if not choices:
+                break
+            aligned = [scores for scores in ([item_score(item) for item in parse_response_items(choice)]
+                                             for choice in choices) if len(scores) == len(papers)]
+            if not aligned:
+                print(f"Warning: calibration answers do not match the {len(papers)} papers, keeping the scores")
+                break
+            runs.extend(aligned[:n])
+
+        if not runs:
+            continue
+        for idx, (paper, item) in enumerate(chunk):
+            values = [run[idx] for run in runs]
+            item["Score samples"] = values
+            item["Relevancy score"] = math.floor(statistics.median(values) + 0.5)
+            calibrated.append((paper, item))
+    return calibrated
+
+
+def two_stage_relevance_score(all_papers, query, model_name="gpt-3.5-turbo-16k", threshold_score=6,
+                              num_paper_in_prompt=8, temperature=0.4, top_p=1.0, custom_api_config=None,
+                              score_cache=None, top_k=None, budget=None, score_batch_size=32, batch_control=None,
+                              calibration_samples=0, calibration_margin=1):
+    """
+    Two-stage scoring: a cheap score-only pass over all papers, then the full
+    bilingual reasons and summaries only for papers at or above threshold_score
+    (at most top_k of them). The first-pass scores, calibrated in the first stage,
+    are kept in the result.
+    """
+    scored, hallucination, unscored = score_only_pass(
+        all_papers, query, model_name, score_batch_size, temperature, top_p, custom_api_config, score_cache, budget,
+        threshold_score, calibration_samples, calibration_margin
+    )
+    winners = [(score, paper) for score, paper in scored if score >= threshold_score]
+    if top_k:
+        # 稳定排序，同分时保留先出现的论文
+        winners = sorted(winners, key=lambda x: x[0], reverse=True)[:top_k]
+    print(f"Score-only pass selected {len(winners)}/{len(all_papers)} papers for summaries")
+
+    ans_data, hallu = summarize_winners(
+        winners, query, model_name, num_paper_in_prompt, temperature, top_p, custom_api_config, score_cache,
+        budget, batch_control
+    )
+    if unscored and budget is not None and budget.on_exhausted == "keywords":
+        fallback = keyword_rank(unscored, query["interest"])
+        ans_data += fallback[:top_k - len(ans_data) if top_k else None]
+    return ans_data, hallucination or hallu
+
+
+def summarize_winners(winners, query, model_name="gpt-3.5-turbo-16k", num_paper_in_prompt=8, temperature=0.4,
+                      top_p=1.0, custom_api_config=None, score_cache=None, budget=None, batch_control=None):
+    """
+    Second stage of two-stage scoring: the full reasons and summaries for the
+    (score, paper) winners of the score-only pass, keeping the first-pass scores.
+    Winners left without a summary by the budget are ranked by keyword match
+    (see keyword_rank) and appended unchanged after the summarized papers.
+
+    Returns:
+        tuple: (papers sorted by score, hallucination)
+    """
+    scores = {paper["main_page"]: score for score, paper in winners}
+    unsummarized = []
+    ans_data, hallucination = generate_relevance_score(
+        [paper for _, paper in winners], query, model_name, threshold_score=0,
+        num_paper_in_prompt=num_paper_in_prompt, temperature=temperature, top_p=top_p, sorting=False,
+        custom_api_config=custom_api_config, score_cache=score_cache, budget=budget, batch_control=batch_control,
+        unscored=unsummarized
+    )
+    for paper in ans_data:
+        paper["Relevancy score"] = scores[paper["main_page"]]
+    ans_data = sorted(ans_data, key=item_score, reverse=True)
+    if unsummarized and budget is not None and budget.on_exhausted == "keywords":
+        ans_data += keyword_rank(unsummarized, query["interest"])
+    return ans_data, hallucination
+
+
+class TopKPapers:
+    """
+    Bounded streaming selection of the highest scoring papers.
+
+    Keeps at most k papers (all of them when k is None) in a min-heap keyed by
+    (score, -arrival), so ties are resolved in favour of earlier papers exactly
+    like a stable full sort. Evicted papers have their LLM text fields released.
+    """
+
+    # 被淘汰论文上释放的大字段
+    _RELEASED_KEYS = ("Reasons for match", "中文原因", "Detailed Summary", "详细总结")
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        self._arrivals = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def cutoff(self, threshold_score):
+        """Minimum score a new paper needs to enter the selection."""
+        if self.k is None or len(self._heap) < self.k:
+            return threshold_score
+        return max(threshold_score, self._heap[0][0] + 1)
+
+    def push(self, paper, order=None):
+        """
+        Add one paper; returns the paper that dropped out of the selection (possibly paper itself) or None
+        order: position used for ties instead of the arrival count, for papers arriving out of order
+        """
+        entry = (item_score(paper), -(self._arrivals if order is None else order), paper)
+        self._arrivals += 1
+        if self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return None
+        if entry[:2] > self._heap[0][:2]:
+            evicted = heapq.heapreplace(self._heap, entry)[2]
+        else:
+            evicted = paper
+        self._release(evicted)
+        return evicted
+
+    def extend(self, papers):
+        for paper in papers:
+            self.push(paper)
+
+    def _release(self, paper):
+        for key in self._RELEASED_KEYS:
+            paper.pop(key, None)
+
+    def sorted(self):
+        return [paper for _, _, paper in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+
+def score_cache_key(model_name, query, custom_api_config=None, score_only=False):
+    """Cache key of a scoring setup: the effective model plus the interest text."""
+    if custom_api_config and custom_api_config.use_custom_api:
+        model_name = custom_api_config.model_name
+    if score_only:
+        # 只有分数的结果与完整结果分开缓存，避免完整评分时命中缺少总结的条目
+        model_name += ":score-only"
+    return interest_key(model_name, query['interest'])
+
+
 def run_all_day_paper(
     query={"interest":"", "subjects":["Computation and Language", "Artificial Intelligence"]},
     date=None,
@@ -308,10 +901,7 @@ def run_all_day_paper(
         print(f"No data file found for {date}")
         return [], False
 
-    all_papers_in_subjects = [
-        t for t in all_papers
-        if bool(set(process_subject_fields(t['subjects'])) & set(query['subjects']))
-    ]
+    all_papers_in_subjects = filter_papers_by_subjects(all_papers, query['subjects'])
     print(f"After filtering subjects, we have {len(all_papers_in_subjects)} papers left.")
 
     if not all_papers_in_subjects:
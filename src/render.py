@@ -0,0 +1,382 @@
+"""
+Digest rendering
+
+Templates are compiled once at import and every paper field is HTML-escaped.
+Papers are rendered in a single pass into StringIO buffers, producing the HTML
+body and a plain-text alternative together.
+
+Bodies carry class attributes only. render_page either inlines the styles per
+element (default, for mail clients that drop <style>) or, in compact mode,
+keeps a single minified <style> block. With a byte budget, lower-ranked papers
+are folded into one-line entries so that large days stay below Gmail's
+clipping limit (~102KB).
+"""
+import dataclasses
+import html
+import io
+import re
+from string import Template
+
+# 所有样式只在这里定义一次
+STYLES = {
+    "paper": "margin-bottom: 20px; border-bottom: 1px solid #eee; padding-bottom: 15px;",
+    "listing": "margin-bottom: 15px;",
+    "folded": "margin: 4px 0;",
+    "notice": "background-color: #fff3cd; border: 1px solid #ffeaa7; margin-bottom: 20px; "
+              "border-radius: 5px; padding: 10px;",
+    "test-notice": "background-color: #fff3cd; border: 1px solid #ffeaa7; margin-bottom: 20px; "
+                   "border-radius: 5px; padding: 15px;",
+}
+_PAGE_STYLES = {
+    "body": "font-family: Arial, sans-serif; max-width: 1200px; margin: 0 auto; padding: 20px;",
+    "h1": "color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px;",
+    "h3": "color: #2980b9;",
+    "a": "color: #3498db; text-decoration: none;",
+    "a:hover": "text-decoration: underline;",
+}
+
+# Gmail 在 HTML 超过约 102KB 时截断邮件
+GMAIL_CLIP_BYTES = 102 * 1024
+# 为页头和提示框预留的字节数
+_PAGE_RESERVE = 2048
+# 完整论文块最多占用的预算比例，其余留给折叠后的论文列表
+_FULL_ENTRY_SHARE = 0.8
+
+_SCORED_PAPER = Template(
+    '<div class="paper">'
+    '<h3><a href="$link" target="_blank">$title</a></h3>'
+    '<p><strong>Authors:</strong> $authors</p>'
+    '<p><strong>Relevancy Score:</strong> $score/10</p>'
+    '$details</div>'
+)
+_LISTED_PAPER = Template(
+    '<div class="listing">'
+    '<h4><a href="$link" target="_blank">$title</a></h4>'
+    '<p><strong>Authors:</strong> $authors</p></div>'
+)
+_FOLDED_PAPER = Template('<li class="folded"><a href="$link" target="_blank">$title</a>$score</li>')
+_DETAIL = Template('<p><strong>$label:</strong> $value</p>')
+_NOTICE = Template('<div class="$style">$content</div>')
+
+_PAGE = Template('''<html>
+<head>
+<meta charset="UTF-8">
+<style>
+$css
+</style>
+</head>
+<body>
+<h1>Personalized arXiv Digest - $title</h1>
+<h1>个性化arXiv文献摘要 - $title</h1>
+$body</body></html>''')
+_COMPACT_PAGE = Template(
+    '<html><head><meta charset="UTF-8"><style>$css</style></head><body>'
+    '<h1>Personalized arXiv Digest - $title</h1><h1>个性化arXiv文献摘要 - $title</h1>'
+    '$body</body></html>'
+)
+
+_CLASS_ATTR = re.compile(r'class="([\w-]+)"')
+
+# (响应字段, HTML 标签, 纯文本标签)
+DETAIL_FIELDS = (
+    ("Reasons for match", "Relevance (EN)", "Relevance"),
+    ("中文原因", "相关性 (中文)", "相关性"),
+    ("Detailed Summary", "Detailed Summary (EN)", "Summary"),
+    ("详细总结", "详细总结 (中文)", "详细总结"),
+)
+
+_HALLUCINATION_MESSAGE = (
+    "The model may have hallucinated some papers. "
+    "We have tried to remove them, but the scores may not be accurate."
+)
+HALLUCINATION_WARNING = f"Warning: {_HALLUCINATION_MESSAGE}"
+_HALLUCINATION_NOTICE = f"<strong>Warning:</strong> {html.escape(_HALLUCINATION_MESSAGE)}"
+
+
+@dataclasses.dataclass
+class Digest(object):
+    """Rendered digest body in both formats"""
+    html: str = ""
+    text: str = ""
+
+    def __add__(self, other):
+        return Digest(self.html + other.html, self.text + other.text)
+
+
+def _escape(value):
+    # 折叠空白：浏览器本就如此显示，同时减小体积
+    return html.escape(" ".join(str(value).split()), quote=True)
+
+
+def _css(compact):
+    rules = list(_PAGE_STYLES.items()) + [(f".{name}", style) for name, style in STYLES.items()]
+    if compact:
+        return "".join(f"{selector}{{{style.replace(': ', ':').replace('; ', ';')}}}" for selector, style in rules)
+    return "\n".join(f"{selector} {{ {style} }}" for selector, style in rules)
+
+
+def notice(html_content, text_content, style="notice"):
+    """
+    Highlighted notice box. html_content is trusted markup.
+    """
+    return Digest(_NOTICE.substitute(style=style, content=html_content), text_content.strip() + "\n\n")
+
+
+def test_mode_notice(num_papers):
+    return notice(
+        "<strong>🧪 测试模式</strong><br>"
+        f"此邮件为ArXiv Digest测试模式生成，仅包含 {num_papers} 篇论文用于验证功能。<br>"
+        "<strong>🧪 Test Mode</strong><br>"
+        f"This email is generated in ArXiv Digest test mode, containing only {num_papers} paper(s) for verification.",
+        f"🧪 测试模式 / Test Mode: {num_papers} paper(s) for verification.",
+        style="test-notice",
+    )
+
+
+def _scored_entry(paper):
+    details = io.StringIO()
+    text = io.StringIO()
+    text.write(f"{paper['title']}\n{paper['main_page']}\n"
+               f"Authors: {paper['authors']}\nRelevancy Score: {paper['Relevancy score']}/10\n")
+    for key, label, text_label in DETAIL_FIELDS:
+        if key in paper:
+            details.write(_DETAIL.substitute(label=label, value=_escape(paper[key])))
+            text.write(f"{text_label}: {paper[key]}\n")
+    text.write("\n")
+    entry_html = _SCORED_PAPER.substitute(
+        link=_escape(paper["main_page"]),
+        title=_escape(paper["title"]),
+        authors=_escape(paper["authors"]),
+        score=_escape(paper["Relevancy score"]),
+        details=details.getvalue(),
+    )
+    return entry_html, text.getvalue()
+
+
+def _listed_entry(paper):
+    entry_html = _LISTED_PAPER.substitute(
+        link=_escape(paper["main_page"]),
+        title=_escape(paper["title"]),
+        authors=_escape(paper["authors"]),
+    )
+    return entry_html, f"{paper['title']}\n{paper['main_page']}\nAuthors: {paper['authors']}\n\n"
+
+
+def _folded_entry(paper):
+    score = paper.get("Relevancy score")
+    suffix = f" ({score}/10)" if score is not None else ""
+    entry_html = _FOLDED_PAPER.substitute(
+        link=_escape(paper["main_page"]), title=_escape(paper["title"]), score=html.escape(suffix)
+    )
+    return entry_html, f"- {paper['title']}{suffix} {paper['main_page']}\n"
+
+
+def _archive_link(archive_url, html_out, text_out, omitted):
+    prefix = f"…and {omitted} more, see" if omitted else "See"
+    if archive_url:
+        html_out.write(f'<p>{prefix} the <a href="{_escape(archive_url)}" target="_blank">full digest</a>.</p>')
+        text_out.write(f"{prefix} the full digest: {archive_url}\n")
+    elif omitted:
+        html_out.write(f'<p>…and {omitted} more.</p>')
+        text_out.write(f"...and {omitted} more.\n")
+
+
+def _render_entries(papers, render_entry, html_out, text_out, max_bytes=None, archive_url=None):
+    """
+    Write papers in rank order. Full entries may use most of max_bytes; the
+    remaining papers are folded to one line each, and once even those do not
+    fit, the rest is only counted and linked to archive_url.
+    """
+    size = len(html_out.getvalue().encode("utf-8"))
+    full_limit = None if max_bytes is None else max_bytes * _FULL_ENTRY_SHARE
+    folded_from = None
+    for index, paper in enumerate(papers):
+        entry_html, entry_text = render_entry(paper)
+        entry_size = len(entry_html.encode("utf-8"))
+        if full_limit is not None and size + entry_size > full_limit:
+            folded_from = index
+            break
+        html_out.write(entry_html)
+        text_out.write(entry_text)
+        size += entry_size
+    if folded_from is None:
+        return
+
+    folded = papers[folded_from:]
+    # 不用标题标签：工作流按 <h3> 数量统计论文篇数
+    html_out.write(f'<p class="folded"><strong>{len(folded)} more papers</strong></p><ul>')
+    text_out.write(f"\n{len(folded)} more papers:\n")
+    omitted = 0
+    for paper in folded:
+        entry_html, entry_text = _folded_entry(paper)
+        entry_size = len(entry_html.encode("utf-8"))
+        if omitted or size + entry_size > max_bytes:
+            omitted += 1
+            continue
+        html_out.write(entry_html)
+        text_out.write(entry_text)
+        size += entry_size
+    html_out.write('</ul>')
+    _archive_link(archive_url, html_out, text_out, omitted)
+
+
+def _budget(max_bytes):
+    return None if max_bytes is None else max(max_bytes - _PAGE_RESERVE, 0)
+
+
+def render_scored(papers, hallucination=False, max_bytes=None, archive_url=None):
+    """
+    Render scored papers with their bilingual reasons and summaries
+
+    max_bytes: optional size budget for the page; papers are expected in rank
+               order and the lowest ranked ones are folded first
+    archive_url: optional link to the complete digest, shown when papers are folded
+    """
+    return _render_scored(papers, _scored_entry, hallucination, max_bytes, archive_url)
+
+
+def _render_scored(papers, render_entry, hallucination, max_bytes, archive_url):
+    html_out, text_out = io.StringIO(), io.StringIO()
+    if hallucination:
+        warning = notice(_HALLUCINATION_NOTICE, HALLUCINATION_WARNING)
+        html_out.write(warning.html)
+        text_out.write(warning.text)
+    _render_entries(papers, render_entry, html_out, text_out, _budget(max_bytes), archive_url)
+    return Digest(html_out.getvalue(), text_out.getvalue())
+
+
+def render_listing(papers, max_bytes=None, archive_url=None):
+    """
+    Simple listing without relevancy scoring
+    """
+    html_out, text_out = io.StringIO(), io.StringIO()
+    _render_entries(papers, _listed_entry, html_out, text_out, _budget(max_bytes), archive_url)
+    return Digest(html_out.getvalue(), text_out.getvalue())
+
+
+class EntryRenderer:
+    """
+    Renders each paper's entry as soon as the paper is available, for pipelines
+    that score in batches; render() then only puts the prepared entries in rank
+    order and applies the size budget.
+
+    With top_k, only the top_k highest scoring papers (and their entries) are kept.
+    Papers added with an order are kept in rank order, ties broken by that order.
+    """
+
+    def __init__(self, scored=True, top_k=None):
+        self.scored = scored
+        self._papers = []
+        self._render_entry = _scored_entry if scored else _listed_entry
+        self._entries = {}
+        self._selection = None
+        if top_k:
+            self._select(top_k)
+
+    def _select(self, top_k):
+        from relevancy import TopKPapers
+
+        self._selection = TopKPapers(top_k)
+        for paper in self._papers:
+            self._selection.push(paper)
+        self._papers = []
+
+    @property
+    def papers(self):
+        """Papers kept so far, in rank order when bounded by top_k or added with an order"""
+        return self._selection.sorted() if self._selection is not None else self._papers
+
+    def add(self, paper, order=None):
+        if order is not None and self._selection is None:
+            self._select(None)
+        if self._selection is not None:
+            evicted = self._selection.push(paper, order)
+            if evicted is paper:
+                return
+            if evicted is not None:
+                self._entries.pop(id(evicted), None)
+        else:
+            self._papers.append(paper)
+        self._entries[id(paper)] = self._render_entry(paper)
+
+    def _entry(self, paper):
+        # 不是经 add() 加入的论文 (如 watermark 中之前入选的论文) 在此时渲染
+        entry = self._entries.get(id(paper))
+        return entry if entry is not None else self._render_entry(paper)
+
+    def render(self, papers, hallucination=False, max_bytes=None, archive_url=None):
+        """Same output as render_scored / render_listing for papers in this order"""
+        if self.scored:
+            return _render_scored(papers, self._entry, hallucination, max_bytes, archive_url)
+        html_out, text_out = io.StringIO(), io.StringIO()
+        _render_entries(papers, self._entry, html_out, text_out, _budget(max_bytes), archive_url)
+        return Digest(html_out.getvalue(), text_out.getvalue())
+
+
+def render_message(message):
+    """A plain message such as "No papers found"."""
+    return Digest(f"<p>{_escape(message)}</p>", message + "\n")
+
+
+def inline_styles(body):
+    """Replace the class attributes of rendered entries with inline styles"""
+    return _CLASS_ATTR.sub(
+        lambda m: f'style="{STYLES[m.group(1)]}"' if m.group(1) in STYLES else m.group(0), body
+    )
+
+
+def render_page(digest, mode_title, compact=False):
+    """
+    Wrap a digest body into the full HTML page and the matching plain-text part
+
+    compact: keep one minified <style> block instead of inline styles per element
+
+    Returns:
+        tuple: (html, text)
+    """
+    if compact:
+        page_html = _COMPACT_PAGE.substitute(css=_css(True), title=_escape(mode_title), body=digest.html)
+    else:
+        page_html = _PAGE.substitute(css=_css(False), title=_escape(mode_title), body=inline_styles(digest.html))
+    header = f"Personalized arXiv Digest - {mode_title}\n个性化arXiv文献摘要 - {mode_title}\n"
+    page_text = header + "=" * 60 + "\n\n" + digest.text
+    return page_html, page_text
+
+
+def _synthetic_papers(n):
+    return [{
+        "main_page": f"https://arxiv.org/abs/2405.{i:05d}",
+        "title": f"Paper {i}: bounds for <b>adaptive</b> & robust control",
+        "authors": "A. Author, B. Author",
+        "Relevancy score": 10 - i % 4,
+        "Reasons for match": "Matches the interest in analog circuit sizing. " * 4,
+        "中文原因": "与模拟电路设计优化相关。" * 4,
+        "Detailed Summary": "The paper proposes a method for circuit optimization. " * 12,
+        "详细总结": "论文提出了一种电路优化方法。" * 12,
+    } for i in range(n)]
+
+
+def benchmark_render(num_papers=2000, repeat=5, max_bytes=None):
+    """
+    Render a synthetic backfill-sized digest and report time and size
+    """
+    import time
+
+    papers = _synthetic_papers(num_papers)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = render_scored(papers, max_bytes=max_bytes, archive_url="https://example.org/digest.html")
+        page_html, page_text = render_page(body, "Benchmark", compact=max_bytes is not None)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{num_papers} papers: {elapsed * 1000:.1f} ms per digest, "
+          f"HTML {len(page_html.encode('utf-8')) / 1024:.0f} KB, text {len(page_text.encode('utf-8')) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=2000, help="Number of synthetic papers to render")
+    parser.add_argument("--max-kb", type=int, help="Render in compact mode within this size budget")
+    args = parser.parse_args()
+    benchmark_render(args.papers, max_bytes=args.max_kb * 1024 if args.max_kb else None)
@@ -0,0 +1,64 @@
+"""
+Persistent cache of per-paper LLM scoring results
+
+Responses are keyed by model, interest and arXiv id, so re-running a day (a retry,
+a backfill over an already scored range, another digest with the same interest)
+only sends the papers that were never scored before.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from download_new_papers import paper_id
+from paper import Score
+
+
+def interest_key(model_name, interest):
+    """Stable key for a (model, interest) pair."""
+    digest = hashlib.sha1(f"{model_name}\n{interest}".encode("utf-8")).hexdigest()
+    return digest[:16]
+
+
+class ScoreCache:
+    """
+    Append-only JSONL cache: one line per scored paper, loaded once into memory
+    as paper.Score records.
+    Safe to share between threads scoring different days.
+    """
+
+    def __init__(self, path="./data/score_cache.jsonl"):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a run killed mid-write leaves a partial last line
+                    self._entries[(record["key"], record["id"])] = Score.from_item(record["item"])
+        print(f"📦 Score cache {path}: {len(self._entries)} entries")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, paper):
+        """The cached response item of a paper, as a new dict, or None"""
+        score = self._entries.get((key, paper_id(paper)))
+        return None if score is None else score.to_item()
+
+    def put_many(self, key, papers, items):
+        """Store the response items of a batch whose items line up with its papers."""
+        records = []
+        with self._lock:
+            for paper, item in zip(papers, items):
+                pid = paper_id(paper)
+                self._entries[(key, pid)] = Score.from_item(item)
+                records.append(json.dumps({"key": key, "id": pid, "item": item}, ensure_ascii=False))
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(record + "\n" for record in records))
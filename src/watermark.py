@@ -0,0 +1,92 @@
+"""
+Per-subscriber watermark of processed papers for incremental runs
+
+Records which arXiv ids of each listing day were already scored and sent to a
+subscriber, so a retry, a manual dispatch or a second run on the same day only
+scores the papers that appeared since. The relevant papers of the day are kept
+too, which lets a run send a cumulative digest instead of only the new part.
+"""
+import datetime
+import hashlib
+import json
+import os
+
+from download_new_papers import paper_id, _today
+
+# 保存到状态文件时去掉的冗余字段 (可由其它字段重新生成)
+_DROPPED_KEYS = ("summarized_text", "pdf", "subject_mask")
+
+
+def subscriber_id(config_path, to_email=None, config=None):
+    """
+    订阅者标识：优先使用配置中的 subscriber，否则由配置文件名和收件人推出
+    """
+    if config and config.get("subscriber"):
+        return config["subscriber"]
+    stem = os.path.splitext(os.path.basename(config_path))[0]
+    if not to_email:
+        return stem
+    return f"{stem}-{hashlib.sha1(to_email.encode('utf-8')).hexdigest()[:8]}"
+
+
+class Watermark:
+    """
+    状态文件 {state_dir}/{subscriber}.json:
+        {"days": {"2024-05-15": {"ids": [...], "relevant": [paper, ...]}}}
+    只保留最近 keep_days 天
+    """
+
+    def __init__(self, subscriber, state_dir="./state", keep_days=7):
+        self.subscriber = subscriber
+        self.path = os.path.join(state_dir, f"{subscriber}.json")
+        self.keep_days = keep_days
+        self.days = {}
+        self.new_papers = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.days = json.load(f).get("days", {})
+        print(f"🔖 Watermark {self.path}: {sum(len(d['ids']) for d in self.days.values())} processed papers")
+
+    def _day(self, day=None):
+        key = (day or _today()).isoformat()
+        return self.days.setdefault(key, {"ids": [], "relevant": []})
+
+    def unseen(self, papers, day=None):
+        """
+        过滤掉已处理过的论文，同时记录新论文数量
+        """
+        seen = set(self._day(day)["ids"])
+        fresh = [paper for paper in papers if paper_id(paper) not in seen]
+        self.new_papers = len(fresh)
+        print(f"🔖 {len(papers) - len(fresh)} papers already processed, {len(fresh)} new")
+        return fresh
+
+    def previous_relevant(self, day=None):
+        """
+        之前运行中已入选 digest 的论文
+        """
+        return [dict(paper) for paper in self._day(day)["relevant"]]
+
+    def record(self, processed, relevant, day=None):
+        """
+        记录本次处理过的论文和入选论文 (调用 save() 后才写入磁盘)
+        """
+        state = self._day(day)
+        seen = set(state["ids"])
+        state["ids"].extend(pid for pid in map(paper_id, processed) if pid not in seen)
+        known = {paper_id(paper) for paper in state["relevant"]}
+        for paper in relevant:
+            if paper_id(paper) not in known:
+                state["relevant"].append({k: v for k, v in paper.items() if k not in _DROPPED_KEYS})
+
+    def save(self):
+        cutoff = (_today() - datetime.timedelta(days=self.keep_days)).isoformat()
+        self.days = {day: state for day, state in self.days.items() if day > cutoff}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"subscriber": self.subscriber, "days": self.days}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        print(f"🔖 Watermark saved: {self.path}")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+HTTP API 冒烟测试
+用 FastAPI TestClient 在进程内启动 src/api.py，不访问 arXiv 和 LLM：
+列表下载、评分和 digest 生成都替换为本地替身
+
+    python test_api_service.py
+    python -m pytest test_api_service.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+os.environ.setdefault("ARXIV_DIGEST_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "test-config.yaml"))
+os.environ["ARXIV_DIGEST_SCORE_CACHE"] = os.path.join(tempfile.mkdtemp(), "score_cache.jsonl")
+os.environ["ARXIV_DIGEST_API_SCORING"] = "1"
+os.environ.setdefault("CUSTOM_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+import api
+from render import render_message
+
+PAPER = {
+    "main_page": "https://arxiv.org/abs/2405.00001",
+    "pdf": "https://arxiv.org/pdf/2405.00001",
+    "title": "Transistor sizing with reinforcement learning",
+    "authors": "A. Author",
+    "subjects": "Machine Learning (cs.LG)",
+    "abstract": "We size analog circuits.",
+    "subject_mask": 1,
+}
+
+
+def fake_get_papers(field_abbr, limit=None, date=None, categories=None):
+    return [dict(PAPER)][:limit]
+
+
+def fake_score(papers, query, **kwargs):
+    # 并发检查：信号量只有 1 个名额时，评分与 digest 渲染不应同时进行
+    with _active_lock:
+        _active[0] += 1
+        _active[1] = max(_active)
+    time.sleep(0.05)
+    with _active_lock:
+        _active[0] -= 1
+    return [dict(paper, **{"Relevancy score": 8}) for paper in papers], False
+
+
+def fake_generate_body(config, score_cache=None, **kwargs):
+    fake_score([PAPER], {"interest": config.get("interest")})
+    return render_message("digest for " + str(config.get("interest")))
+
+
+_active = [0, 0]
+_active_lock = threading.Lock()
+api.get_papers = fake_get_papers
+api.generate_relevance_score = fake_score
+api.generate_body_enhanced = fake_generate_body
+
+
+def test_papers():
+    with TestClient(api.app) as client:
+        response = client.get("/papers", params={"field": "cs", "limit": 1})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["count"] == 1
+        assert "subject_mask" not in body["papers"][0]
+
+        assert client.get("/papers", params={"field": "Physics"}).status_code == 400
+
+
+def test_score():
+    with TestClient(api.app) as client:
+        assert isinstance(api.app.state.score_cache, api.ScoreCache)
+        response = client.post("/score", json={"interest": "analog circuits", "papers": [PAPER]})
+        assert response.status_code == 200, response.text
+        assert response.json()["papers"][0]["Relevancy score"] == 8
+
+        assert client.post("/score", json={"interest": "x"}).status_code == 400
+        assert client.post("/score", json={"interest": "x", "papers": [{"title": "t"}]}).status_code == 400
+
+
+def test_digest_shares_scoring_limit():
+    _active[:] = [0, 0]
+    with TestClient(api.app) as client:
+        async def burst():
+            # digest 与 /score 并发到达；ARXIV_DIGEST_API_SCORING=1 时二者必须排队
+            await asyncio.gather(
+                asyncio.to_thread(client.get, "/digest", params={"format": "text", "max_kb": 50}),
+                asyncio.to_thread(client.post, "/score", json={"interest": "x", "papers": [PAPER]}),
+                asyncio.to_thread(client.get, "/digest", params={"format": "html", "max_kb": 60}),
+            )
+        asyncio.run(burst())
+        assert _active[1] == 1, f"{_active[1]} scoring calls ran at once"
+
+        response = client.get("/digest", params={"format": "text", "max_kb": 50})
+        assert response.status_code == 200
+        assert "digest for" in response.text
+        assert client.get("/digest", params={"format": "pdf"}).status_code == 400
+
+
+def main():
+    print("🧪 HTTP API 冒烟测试")
+    passed = True
+    for test in (test_papers, test_score, test_digest_shares_scoring_limit):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Gradio 演示页面测试
+在进程内启动 src/app.py 的界面，不访问 arXiv 和 LLM：列表下载和流式补全都替换为本地替身。
+需要 Gradio 3 (pip install "gradio<4")，未安装时跳过
+
+    python test_app_demo.py
+    python -m pytest test_app_demo.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+os.environ["ARXIV_DIGEST_SCORE_CACHE"] = os.path.join(tempfile.mkdtemp(), "score_cache.jsonl")
+
+try:
+    import gradio  # noqa: F401
+except ImportError:
+    gradio = None
+
+pytestmark = pytest.mark.skipif(gradio is None, reason="Gradio is not installed")
+
+PAPERS = [
+    {
+        "main_page": f"https://arxiv.org/abs/2405.0000{i}",
+        "pdf": f"https://arxiv.org/pdf/2405.0000{i}",
+        "title": f"Paper {i}",
+        "authors": "A. Author",
+        "subjects": "Machine Learning (cs.LG)",
+        "abstract": "We size analog circuits.",
+    }
+    for i in range(4)
+]
+ARGS = ("", "Computer Science", [], [])
+
+# 每次流式请求的记录：发出的片段数、是否已关闭
+_streams = []
+
+
+def fake_get_papers(field_abbr, limit=None, date=None, categories=None):
+    return [dict(paper) for paper in PAPERS][:limit]
+
+
+def _answer_chunks(score):
+    # 按小片段发出，检查跨片段的解析
+    text = json.dumps({"Relevancy score": score, "Reasons for match": "r"}) + "\n"
+    return [text[start:start + 7] for start in range(0, len(text), 7)]
+
+
+SCORES = (5, 8, 6, 7)
+TOTAL_CHUNKS = sum(len(_answer_chunks(score)) for score in SCORES)
+
+
+def fake_stream_completion(prompt, decoding_args, model_name="gpt-3.5-turbo-16k", custom_api_config=None,
+                           **decoding_kwargs):
+    record = {"chunks": 0, "closed": False}
+    _streams.append(record)
+    try:
+        for score in SCORES:
+            time.sleep(0.1)
+            for chunk in _answer_chunks(score):
+                record["chunks"] += 1
+                yield chunk
+    finally:
+        record["closed"] = True
+
+
+def _app():
+    import app
+    import relevancy
+    import utils
+    app.get_papers = fake_get_papers
+    relevancy.utils.stream_completion = fake_stream_completion
+    utils.load_openai()[0].api_key = "test-key"
+    return app
+
+
+def test_sample_streams_one_request():
+    app = _app()
+    _streams.clear()
+    outputs = list(app.sample(*ARGS, "analog circuits", {}))
+    assert len(_streams) == 1, f"{len(_streams)} requests for {len(PAPERS)} papers"
+    # 提示行之后每篇论文刷新一次
+    assert len(outputs) == 1 + len(PAPERS)
+    final = outputs[-1]
+    assert [final.index(f"Paper {i}") for i in (1, 3, 2, 0)] == sorted(final.index(f"Paper {i}") for i in range(4))
+
+    # 第二次运行完全命中缓存，不再请求
+    list(app.sample(*ARGS, "analog circuits", {}))
+    assert len(_streams) == 1
+
+
+def test_stale_run_closes_stream():
+    app = _app()
+    _streams.clear()
+    session = {}
+    run = app.sample(*ARGS, "transistor sizing", session)
+    next(run)  # Scoring 4 papers...
+    next(run)  # 第一篇论文
+    app._start_run(session)
+    assert next(run, None) is None
+    # 过时的运行关闭了流，其余论文不再生成
+    assert _streams[0]["closed"]
+    assert _streams[0]["chunks"] < TOTAL_CHUNKS
+    assert len(_streams) == 1
+
+
+def test_missing_openai_is_reported():
+    app = _app()
+    load_openai = app.utils.load_openai
+    # openai 未安装时 load_openai 返回 (None, "none")
+    app.utils.load_openai = lambda: (None, "none")
+    try:
+        with pytest.raises(gradio.Error, match="Install openai"):
+            list(app.sample(*ARGS, "analog circuits", {}))
+        with pytest.raises(gradio.Error, match="Install openai"):
+            app.register_openai_token("test-key")
+    finally:
+        app.utils.load_openai = load_openai
+
+
+def test_launch_cancels_debounced_run():
+    from gradio_client import Client
+
+    app = _app()
+    _streams.clear()
+    app.demo.launch(prevent_thread_lock=True, show_api=False, quiet=True)
+    try:
+        client = Client(app.demo.local_url, verbose=False)
+        dependencies = app.demo.config["dependencies"]
+        functions = [block_function.fn for block_function in app.demo.fns]
+        change = functions.index(app.sample_debounced)
+        click = functions.index(app.sample)
+        # cancels= 注册为同一触发器上的另一个事件
+        cancel = next(i for i, dependency in enumerate(dependencies)
+                      if dependency["cancels"] and dependency["targets"] == dependencies[click]["targets"])
+        assert change in dependencies[cancel]["cancels"]
+
+        debounced = client.submit(*ARGS, "reinforcement learning", fn_index=change)
+        time.sleep(0.2)
+        job = client.submit(*ARGS, "reinforcement learning", fn_index=click)
+        client.submit(fn_index=cancel)
+        assert "Paper 1" in job.result()
+        assert len(job.outputs()) == 1 + len(PAPERS)
+        # 防抖中的运行被取消，没有发出请求
+        assert not any(debounced.outputs())
+        assert len(_streams) == 1
+    finally:
+        app.demo.close()
+
+
+def main():
+    if gradio is None:
+        print("⏭️ Gradio 未安装，跳过")
+        return True
+    print("🧪 Gradio 演示页面测试")
+    passed = True
+    for test in (test_sample_streams_one_request, test_stale_run_closes_stream, test_missing_openai_is_reported,
+                 test_launch_cancels_debounced_run):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+历史回填测试
+用 fixtures/oai 中保存的 OAI-PMH 响应离线运行 src/backfill.py 的完整流程 (不评分)，
+每日文件并入归档后按日期读取列表，以及 OAISource 请求的日期范围。不访问 arXiv 和 LLM
+
+    python test_backfill.py
+    python -m pytest test_backfill.py
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from backfill import FixtureSource, OAISource, run_backfill
+from download_new_papers import get_papers, has_listing
+
+FIXTURE_DIR = os.path.join(ROOT, "fixtures", "oai")
+CONFIG = {
+    "topic": "Computer Science",
+    "categories": [],
+    "interest": "analog circuit sizing",
+    "threshold": 5,
+}
+START = datetime.date(2024, 5, 1)
+END = datetime.date(2024, 5, 3)
+
+
+def _in_temp_dir(run):
+    # 列表文件写入相对路径 ./data，在临时目录中运行
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        return run()
+    finally:
+        os.chdir(cwd)
+
+
+def test_fixture_backfill_without_scoring():
+    def run():
+        results = run_backfill(CONFIG, START, END, FixtureSource(FIXTURE_DIR), workers=2, score=False)
+        assert [(day.isoformat(), count) for day, count in results] == [
+            ("2024-05-01", 2), ("2024-05-02", 1), ("2024-05-03", 0)]
+        # 按首次提交日期分组写入每日列表文件
+        assert [paper["main_page"] for paper in get_papers("cs", date=START)] == [
+            "https://arxiv.org/abs/2405.00101", "https://arxiv.org/abs/2405.00102"]
+        for day in (START, END):
+            assert os.path.exists(os.path.join("digests", f"digest_{day.isoformat()}.html"))
+    _in_temp_dir(run)
+
+
+def test_fixture_backfill_keeps_existing_files():
+    def run():
+        run_backfill(CONFIG, START, END, FixtureSource(FIXTURE_DIR), workers=1, score=False)
+        path = os.path.join("data", os.listdir("data")[0])
+        mtime = os.stat(path).st_mtime_ns
+        results = run_backfill(CONFIG, START, END, FixtureSource(FIXTURE_DIR), workers=1, score=False)
+        assert [count for _, count in results] == [2, 1, 0]
+        assert os.stat(path).st_mtime_ns == mtime
+    _in_temp_dir(run)
+
+
+def test_listing_falls_back_to_archive():
+    from archive import compact
+
+    def run():
+        run_backfill(CONFIG, START, END, FixtureSource(FIXTURE_DIR), workers=1, score=False)
+        daily = get_papers("cs", date=START)
+        compact("./data", "./archive", remove_daily=True)
+        assert not os.listdir("data")
+        # 每日文件已删除，按日期读取时使用归档
+        assert get_papers("cs", date=START) == daily
+        assert has_listing("cs", START) and not has_listing("cs", END)
+        results = run_backfill(CONFIG, START, END, FixtureSource(FIXTURE_DIR), workers=1, score=False)
+        assert [count for _, count in results] == [2, 1, 0]
+        # 已归档的日期不会重新写入每日文件
+        assert not os.listdir("data")
+    _in_temp_dir(run)
+
+
+def test_oai_until_is_bounded():
+    requested = []
+
+    class Recorder(OAISource):
+        def _fetch(self, params):
+            requested.append(params)
+            with open(os.path.join(FIXTURE_DIR, "cs.xml"), "rb") as f:
+                return f.read()
+
+    list(Recorder(revision_margin_days=14).records("cs", START, END))
+    assert requested[0]["from"] == "2024-05-01"
+    assert requested[0]["until"] == "2024-05-17"
+
+    # 边界不超过今天
+    requested.clear()
+    today = datetime.date.today()
+    list(Recorder(revision_margin_days=14).records("cs", today - datetime.timedelta(days=3), today))
+    assert requested[0]["until"] == today.isoformat()
+
+
+def main():
+    print("🧪 历史回填测试")
+    passed = True
+    for test in (test_fixture_backfill_without_scoring, test_fixture_backfill_keeps_existing_files,
+                 test_listing_falls_back_to_archive, test_oai_until_is_bounded):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
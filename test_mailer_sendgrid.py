@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+SendGrid 投递测试
+用本地 HTTP 替身代替 SendGrid /v3/mail/send，检查 src/mailer.py 的 deliver_sendgrid：
+每个请求最多 1000 个 personalizations、按收件人替换的变量、429/5xx 重试以及失败的报告方式
+
+    python test_mailer_sendgrid.py
+    python -m pytest test_mailer_sendgrid.py
+"""
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from mailer import SENDGRID_MAX_PERSONALIZATIONS, deliver_sendgrid
+
+HTML = "<html><body><p>Hi -name-</p></body></html>"
+
+
+class StandIn:
+    """
+    本地 SendGrid 替身：按顺序返回 statuses 中的状态码 (用完后返回 202)，记录每个请求的 body
+    """
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stand_in.requests.append((self.path, body))
+                status = stand_in.statuses.pop(0) if stand_in.statuses else 202
+                payload = b"" if status == 202 else json.dumps({"errors": [{"message": f"status {status}"}]}).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+def _deliver(stand_in, recipients, **kwargs):
+    return deliver_sendgrid("SG.test", "Digest", HTML, "digest@example.com", recipients, text_content="Hi -name-",
+                            host=stand_in.host, retry_delay=0.01, **kwargs)
+
+
+def test_split_at_max_personalizations():
+    recipients = [f"user{i}@example.com" for i in range(2500)]
+    with StandIn() as stand_in:
+        successful, failed = _deliver(stand_in, recipients)
+    assert successful == recipients and not failed
+    sizes = [len(body["personalizations"]) for _, body in stand_in.requests]
+    assert sizes == [SENDGRID_MAX_PERSONALIZATIONS, SENDGRID_MAX_PERSONALIZATIONS, 500]
+    assert all(path == "/v3/mail/send" for path, _ in stand_in.requests)
+    sent = [p["to"][0]["email"] for _, body in stand_in.requests for p in body["personalizations"]]
+    assert sent == recipients
+
+
+def test_substitutions_per_recipient():
+    recipients = ["ada@example.com", "alan@example.com", "grace@example.com"]
+    substitutions = {r: {"-name-": r.split("@")[0]} for r in recipients[:2]}
+    with StandIn() as stand_in:
+        _deliver(stand_in, recipients, substitutions=substitutions)
+    (_, body), = stand_in.requests
+    by_recipient = {p["to"][0]["email"]: p.get("substitutions") for p in body["personalizations"]}
+    assert by_recipient == {"ada@example.com": {"-name-": "ada"}, "alan@example.com": {"-name-": "alan"},
+                            "grace@example.com": None}
+    # 正文只发送一次，由 SendGrid 按收件人替换
+    assert [c["type"] for c in body["content"]] == ["text/plain", "text/html"]
+    assert body["content"][1]["value"] == HTML
+
+
+def test_rate_limit_and_server_errors_are_retried():
+    recipients = ["a@example.com", "b@example.com"]
+    with StandIn(statuses=[429, 503]) as stand_in:
+        successful, failed = _deliver(stand_in, recipients, max_retries=2)
+    assert successful == recipients and not failed
+    assert len(stand_in.requests) == 3
+
+
+def test_failures_are_reported_per_recipient():
+    recipients = [f"user{i}@example.com" for i in range(3)]
+    # 第一批 400 不重试；第二批重试用尽后仍为 500
+    with StandIn(statuses=[400, 500, 500, 500]) as stand_in:
+        successful, failed = _deliver(stand_in, recipients, batch_size=2, max_retries=2)
+    assert len(stand_in.requests) == 1 + 3
+    assert successful == []
+    assert list(failed) == recipients
+    assert getattr(failed["user0@example.com"], "status_code", None) == 400
+    assert getattr(failed["user2@example.com"], "status_code", None) == 500
+    # 同一批次的收件人共享同一个错误
+    assert failed["user0@example.com"] is failed["user1@example.com"]
+
+
+def main():
+    print("🧪 SendGrid 投递测试")
+    passed = True
+    for test in (test_split_at_max_personalizations, test_substitutions_per_recipient,
+                 test_rate_limit_and_server_errors_are_retried, test_failures_are_reported_per_recipient):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+SMTP 投递测试
+用 aiosmtpd 在本地启动替身服务器，检查 src/mailer.py 的 deliver_smtp：
+并行投递、单个收件人失败不影响其他人、4xx 重试、5xx 不重试、服务器断开后重连。
+需要 aiosmtpd (pip install aiosmtpd)，未安装时跳过
+
+    python test_mailer_smtp.py
+    python -m pytest test_mailer_smtp.py
+"""
+
+import asyncio
+import collections
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+from mailer import SMTPSettings, deliver_smtp
+
+pytestmark = pytest.mark.skipif(Controller is None, reason="aiosmtpd is not installed")
+
+HTML = "<html><body><p>paper</p></body></html>"
+
+
+class StandInHandler:
+    """
+    按收件人地址决定服务器的回答：
+    refused@ 在 RCPT 时被拒绝，reject@ 的 DATA 总是 554，busy@ 第一次 DATA 回 451，
+    drop@ 第一次 DATA 时服务器直接断开连接，其余地址正常接收
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.attempts = collections.Counter()
+        self.delivered = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused@"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        (address,) = envelope.rcpt_tos
+        self.attempts[address] += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        if address.startswith("reject@"):
+            return "554 Message rejected"
+        if address.startswith("busy@") and self.attempts[address] == 1:
+            return "451 Try again later"
+        if address.startswith("drop@") and self.attempts[address] == 1:
+            server.transport.close()
+            return "250 OK"
+        self.delivered.append(address)
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _deliver(handler, recipients, **kwargs):
+    port = _free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        settings = SMTPSettings(host="127.0.0.1", port=port, timeout=10)
+        return deliver_smtp(settings, "Digest", HTML, "digest@example.com", recipients,
+                            text_content="paper", retry_delay=0.01, **kwargs)
+    finally:
+        controller.stop()
+
+
+def test_parallel_delivery():
+    handler = StandInHandler(latency=0.1)
+    recipients = [f"user{i}@example.com" for i in range(8)]
+    start = time.perf_counter()
+    successful, failed = _deliver(handler, recipients, pool_size=4)
+    elapsed = time.perf_counter() - start
+    assert successful == recipients and not failed
+    assert sorted(handler.delivered) == sorted(recipients)
+    assert handler.max_active > 1, "messages were sent one at a time"
+    # 串行需要 8 × 0.1s
+    assert elapsed < 0.6, f"{elapsed:.2f}s"
+
+
+def test_one_failing_recipient_does_not_abort_batch():
+    handler = StandInHandler()
+    recipients = ["a@example.com", "refused@example.com", "b@example.com", "c@example.com"]
+    successful, failed = _deliver(handler, recipients, pool_size=2)
+    assert successful == ["a@example.com", "b@example.com", "c@example.com"]
+    assert list(failed) == ["refused@example.com"]
+
+
+def test_temporary_failure_is_retried():
+    handler = StandInHandler()
+    successful, failed = _deliver(handler, ["busy@example.com", "a@example.com"], pool_size=1)
+    assert successful == ["busy@example.com", "a@example.com"] and not failed
+    assert handler.attempts["busy@example.com"] == 2
+
+
+def test_permanent_failure_is_not_retried():
+    handler = StandInHandler()
+    successful, failed = _deliver(handler, ["reject@example.com", "a@example.com"], pool_size=1, max_retries=3)
+    assert successful == ["a@example.com"]
+    assert getattr(failed["reject@example.com"], "smtp_code", None) == 554
+    assert handler.attempts["reject@example.com"] == 1
+
+
+def test_reconnect_after_server_drops_connection():
+    handler = StandInHandler()
+    recipients = ["drop@example.com", "a@example.com", "b@example.com"]
+    successful, failed = _deliver(handler, recipients, pool_size=1)
+    assert successful == recipients and not failed
+    assert handler.attempts["drop@example.com"] == 2
+
+
+def main():
+    if Controller is None:
+        print("⏭️ aiosmtpd 未安装，跳过")
+        return True
+    print("🧪 SMTP 投递测试")
+    passed = True
+    for test in (test_parallel_delivery, test_one_failing_recipient_does_not_abort_batch,
+                 test_temporary_failure_is_retried, test_permanent_failure_is_not_retried,
+                 test_reconnect_after_server_drops_connection):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
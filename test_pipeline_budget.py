@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+流水线预算测试
+LLM 预算在运行中途用尽时，流水线不应崩溃，且结果与顺序执行 (generate_body_enhanced) 一致：
+模型评分的论文在前，其余论文按关键词排序后排在最后。不访问 arXiv 和 LLM
+
+    python test_pipeline_budget.py
+    python -m pytest test_pipeline_budget.py
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import action
+import budget
+import pipeline
+import relevancy
+import utils
+
+INTEREST = "analog circuit sizing"
+PAPERS = [
+    {
+        "main_page": f"https://arxiv.org/abs/2405.{i:05d}",
+        "pdf": f"https://arxiv.org/pdf/2405.{i:05d}",
+        "title": f"Paper {i}: " + ("analog circuit sizing" if i % 3 == 0 else "circuit layout" if i % 3 == 1
+                                   else "protein folding"),
+        "authors": "A. Author",
+        "subjects": "Optimization and Control (math.OC)",
+        "abstract": "We study one problem.",
+    }
+    for i in range(40)
+]
+CONFIG = {
+    "topic": "Mathematics",
+    "categories": [],
+    "interest": INTEREST,
+    "threshold": 5,
+}
+# 每次请求报告的用量
+USAGE = (300, 200)
+
+
+def fake_get_papers(field_abbr, limit=None, date=None, categories=None):
+    return [dict(paper) for paper in PAPERS][:limit]
+
+
+def fake_completion(prompts, decoding_args, model_name=None, **kwargs):
+    numbers = [int(n) for n in re.findall(r"\d+\. Title: Paper (\d+):", prompts[-1]["content"])]
+    content = "\n".join(json.dumps({"Relevancy score": number % 10 + 1, "Reasons for match": "model"})
+                        for number in numbers)
+    return utils.MockOpenAIChoice(content=content, total_tokens=sum(USAGE), prompt_tokens=USAGE[0],
+                                  completion_tokens=USAGE[1])
+
+
+@contextlib.contextmanager
+def _fakes():
+    # 只在测试期间替换，避免影响同一进程中的其他测试
+    saved = action.get_papers, utils.openai_completion
+    action.get_papers, utils.openai_completion = fake_get_papers, fake_completion
+    try:
+        yield
+    finally:
+        action.get_papers, utils.openai_completion = saved
+
+
+def _budget(requests):
+    """A budget that fits exactly `requests` requests of 8 papers"""
+    # 按提示词最长的一批预留 (编号位数不同，各批提示词长度略有差别)
+    messages = relevancy.encode_messages({"interest": INTEREST}, PAPERS[-8:])
+    reservation = budget.estimate_tokens(utils.prompt_text(messages)) + 256 * 8
+    return budget.TokenBudget(max_run_tokens=(requests - 1) * sum(USAGE) + reservation,
+                              state_dir=tempfile.mkdtemp())
+
+
+def _check(config, requests):
+    with _fakes():
+        sequential = action.generate_body_enhanced(config, budget=_budget(requests))
+        # 单个 worker 时批次按顺序完成，预算在同一批次处用尽
+        pipelined = asyncio.run(pipeline.generate_body_pipelined(config, budget=_budget(requests), workers=1))
+    assert pipelined.html == sequential.html
+    assert pipelined.text == sequential.text
+    return pipelined.text
+
+
+def test_budget_exhausted_mid_run():
+    text = _check(CONFIG, requests=2)
+    entries = [line for line in text.splitlines() if line.startswith("Paper ")]
+    numbers = [int(re.match(r"Paper (\d+)", line).group(1)) for line in entries]
+    # 前两批 (论文 0-15) 由模型评分，其余只按关键词排序并排在最后
+    first_keyword = next(idx for idx, number in enumerate(numbers) if number >= 16)
+    assert first_keyword > 0
+    assert all(number >= 16 for number in numbers[first_keyword:])
+    assert "Keyword match" in text
+
+
+def test_budget_exhausted_with_max_papers():
+    _check(dict(CONFIG, max_papers=10), requests=2)
+
+
+def test_budget_exhausted_before_first_request():
+    text = _check(CONFIG, requests=0)
+    assert "Keyword match" in text
+
+
+def main():
+    print("🧪 流水线预算测试")
+    passed = True
+    for test in (test_budget_exhausted_mid_run, test_budget_exhausted_with_max_papers,
+                 test_budget_exhausted_before_first_request):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
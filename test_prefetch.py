@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+预取调度测试
+检查 src/prefetch.py 的 seconds_until 在纽约夏令时切换前后算出的等待时间
+
+    python test_prefetch.py
+    python -m pytest test_prefetch.py
+"""
+
+import datetime
+import os
+import sys
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from prefetch import seconds_until
+
+EASTERN = pytz.timezone("America/New_York")
+
+
+def _at(*args):
+    return EASTERN.localize(datetime.datetime(*args))
+
+
+def test_same_day():
+    assert seconds_until(0, 5, _at(2024, 5, 14, 23, 0)) == 65 * 60
+    assert seconds_until(12, 0, _at(2024, 5, 14, 11, 30)) == 30 * 60
+
+
+def test_across_dst_start():
+    # 2024-03-10 02:00 EST 拨快到 03:00 EDT，这一天只有 23 小时
+    assert seconds_until(0, 5, _at(2024, 3, 10, 0, 10)) == (23 * 60 - 5) * 60
+    assert seconds_until(3, 5, _at(2024, 3, 10, 1, 0)) == 65 * 60
+
+
+def test_across_dst_end():
+    # 2024-11-03 02:00 EDT 拨回到 01:00 EST，这一天有 25 小时
+    assert seconds_until(0, 5, _at(2024, 11, 3, 0, 10)) == (25 * 60 - 5) * 60
+
+
+def test_now_in_other_timezone():
+    now = _at(2024, 3, 10, 0, 10).astimezone(pytz.utc)
+    assert seconds_until(0, 5, now) == (23 * 60 - 5) * 60
+
+
+def main():
+    print("🧪 预取调度测试")
+    passed = True
+    for test in (test_same_day, test_across_dst_start, test_across_dst_end, test_now_in_other_timezone):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
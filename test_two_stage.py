@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+两阶段评分测试
+检查 src/relevancy.py 的 score_only_pass 和 summarize_winners：分数条数对不上时拆分重试，
+对上后不算幻觉；预算用尽时未生成总结的论文按关键词排序、保持原样排在最后。不访问 LLM
+
+    python test_two_stage.py
+    python -m pytest test_two_stage.py
+"""
+
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import budget
+import relevancy
+import utils
+
+INTEREST = "analog circuit sizing"
+QUERY = {"interest": INTEREST}
+PAPERS = [
+    {
+        "main_page": f"https://arxiv.org/abs/2405.{i:05d}",
+        "pdf": f"https://arxiv.org/pdf/2405.{i:05d}",
+        "title": f"Paper {i}: " + ("analog circuit sizing" if i % 2 == 0 else "circuit layout"),
+        "authors": "A. Author",
+        "subjects": "Optimization and Control (math.OC)",
+        "abstract": "We study one problem.",
+    }
+    for i in range(16)
+]
+USAGE = (300, 200)
+
+
+def _numbers(prompts):
+    return [int(n) for n in re.findall(r"\d+\. Title: Paper (\d+):", prompts[-1]["content"])]
+
+
+def _answer(numbers):
+    content = "\n".join(json.dumps({"Relevancy score": number % 10 + 1, "Reasons for match": "model"})
+                        for number in numbers)
+    return utils.MockOpenAIChoice(content=content, total_tokens=sum(USAGE), prompt_tokens=USAGE[0],
+                                  completion_tokens=USAGE[1])
+
+
+@contextlib.contextmanager
+def _completion(fake):
+    saved = utils.openai_completion
+    utils.openai_completion = fake
+    try:
+        yield
+    finally:
+        utils.openai_completion = saved
+
+
+def test_split_retry_that_realigns_is_not_hallucination():
+    requests = []
+
+    def fake(prompts, decoding_args, model_name=None, **kwargs):
+        numbers = _numbers(prompts)
+        requests.append(len(numbers))
+        # 多于两篇的批次少给一个分数
+        return _answer(numbers[:-1] if len(numbers) > 2 else numbers)
+
+    with _completion(fake):
+        scored, hallucination, remaining = relevancy.score_only_pass(PAPERS[:8], QUERY, "gpt-4o-mini", batch_size=8)
+    assert not hallucination
+    assert [paper["main_page"] for _, paper in scored] == [paper["main_page"] for paper in PAPERS[:8]]
+    assert [score for score, _ in scored] == [i % 10 + 1 for i in range(8)]
+    assert not remaining
+    assert requests == [8, 4, 2, 2, 4, 2, 2]
+
+
+def test_paper_still_unmatched_is_hallucination():
+    def fake(prompts, decoding_args, model_name=None, **kwargs):
+        numbers = _numbers(prompts)
+        # 论文 5 永远没有分数
+        return _answer([number for number in numbers if number != 5])
+
+    with _completion(fake):
+        scored, hallucination, _ = relevancy.score_only_pass(PAPERS[:8], QUERY, "gpt-4o-mini", batch_size=8)
+    assert hallucination
+    assert [paper["title"] for _, paper in scored] == [PAPERS[i]["title"] for i in range(8) if i != 5]
+
+
+def test_unsummarized_winners_keep_keyword_scores():
+    def fake(prompts, decoding_args, model_name=None, **kwargs):
+        return _answer(_numbers(prompts))
+
+    # 预算只够第一次请求 (8 篇论文)
+    messages = relevancy.encode_messages(QUERY, PAPERS[-8:])
+    reservation = budget.estimate_tokens(utils.prompt_text(messages)) + 256 * 8
+    limit = budget.TokenBudget(max_run_tokens=reservation, state_dir=tempfile.mkdtemp())
+    winners = [(9, dict(paper)) for paper in PAPERS]
+    with _completion(fake):
+        ans_data, _ = relevancy.summarize_winners(winners, QUERY, "gpt-4o-mini", num_paper_in_prompt=8, budget=limit)
+
+    summarized, fallback = ans_data[:8], ans_data[8:]
+    # 生成了总结的论文保留第一阶段的分数
+    assert [paper["main_page"] for paper in summarized] == [paper["main_page"] for paper in PAPERS[:8]]
+    assert all(paper["Relevancy score"] == 9 for paper in summarized)
+    # 其余论文保持关键词排序的结果，不被第一阶段的分数覆盖
+    expected = relevancy.keyword_rank(PAPERS[8:], INTEREST)
+    assert fallback == expected
+    assert all(paper["Reasons for match"].startswith("Keyword match") for paper in fallback)
+    assert [paper["Relevancy score"] for paper in fallback] != [9] * len(fallback)
+
+
+def main():
+    print("🧪 两阶段评分测试")
+    passed = True
+    for test in (test_split_retry_that_realigns_is_not_hallucination, test_paper_still_unmatched_is_hallucination,
+                 test_unsummarized_winners_keep_keyword_scores):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)